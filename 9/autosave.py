@@ -0,0 +1,105 @@
+"""Periodic background autosave of the document."""
+
+import os
+import queue
+import threading
+import time
+
+from document import Shape, muted
+from journal import read_journal
+from project import ProjectFile, save_shapes
+
+
+def materialize(snapshot):
+    """Shapes from a Document.snapshot(), copying the shared data (worker side)."""
+    shapes = []
+    for shape_id, z, kind, coords, length, style in snapshot:
+        shape = Shape(kind, (), **style)
+        shape.coords = coords[:length]
+        shape.id, shape.z = shape_id, z
+        shapes.append(shape)
+    return shapes
+
+
+def unread_shapes(source, snapshot, removed):
+    """Shapes of project file source that are not in the snapshot and were not removed."""
+    skip = {entry[0] for entry in snapshot} | removed
+    with ProjectFile(source) as project:
+        project.apply(*read_journal(source, project.checkpoint))
+        return [shape for shape in project.read() if shape.id not in skip]
+
+
+class Autosaver:
+    """Write the document to path every interval_ms when it has changed.
+
+    The snapshot is taken on the Tk thread (see Document.snapshot; it copies
+    no points) and everything else -- copying, encoding, writing and fsync --
+    happens on a worker thread, so autosaving never stalls the editor.
+    callback(kind, *payload) is called on the Tk thread with ("saved", path,
+    seconds, size) or ("error", message).
+    """
+
+    def __init__(self, widget, document, path, callback, interval_ms=60000, poll_ms=100):
+        self.widget = widget
+        self.document = document
+        self.path = path
+        self.callback = callback
+        self.interval_ms = interval_ms
+        self.poll_ms = poll_ms
+        self.results = queue.Queue()
+        self.changed = False
+        self.busy = False
+        self._paused = False
+        # callable returning (source, removed, view) for the next save, see save()
+        self.context = None
+        document.listeners.append(self.on_change)
+        self.widget.after(self.interval_ms, self.tick)
+
+    def paused(self):
+        """Context in which document events do not count as unsaved changes."""
+        return muted(self)
+
+    def on_change(self, event, shape, **info):
+        if not self._paused:
+            self.changed = True
+
+    def tick(self):
+        self.widget.after(self.interval_ms, self.tick)
+        if self.changed and not self.busy:
+            self.save()
+
+    def save(self):
+        """Start a background save now.
+
+        If context gives a source, it is a project file whose shapes are not
+        all paged in yet: the worker adds the ones missing from the snapshot,
+        minus the removed ids.  view is stored as in project.save_project.
+        """
+        self.changed = False
+        self.busy = True
+        source, removed, view = self.context() if self.context else (None, (), None)
+        snapshot = self.document.snapshot()
+        args = (snapshot, source, set(removed), view)
+        threading.Thread(target=self._write, args=args, daemon=True).start()
+        self.widget.after(self.poll_ms, self._poll)
+
+    def _write(self, snapshot, source, removed, view):
+        # Runs on the worker thread: only the snapshot is touched here
+        try:
+            start = time.perf_counter()
+            shapes = materialize(snapshot)
+            if source is not None:
+                shapes += unread_shapes(source, snapshot, removed)
+            save_shapes(shapes, self.path, view)
+            self.results.put(("saved", self.path, time.perf_counter() - start, os.path.getsize(self.path)))
+        except Exception as exc:
+            self.results.put(("error", str(exc)))
+
+    def _poll(self):
+        try:
+            result = self.results.get_nowait()
+        except queue.Empty:
+            self.widget.after(self.poll_ms, self._poll)
+            return
+        self.busy = False
+        self.callback(*result)
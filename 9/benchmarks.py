@@ -0,0 +1,189 @@
+"""Micro-benchmarks for GraphyX drawing paths.
+
+Run with: python benchmarks.py  (needs a display for the Tk based cases)
+"""
+
+import math
+import os
+import random
+import resource
+import tempfile
+import time
+import tkinter as tk
+
+from PIL import Image
+
+from document import Document, Shape
+from export import export_bounds, render_document, snapshot, write_tiled_png
+from imagery import ImageRegistry
+from renderer import CanvasRenderer
+
+
+def scribble(samples, seed_x=400, seed_y=300):
+    """Flat coordinate list of a wobbly pencil stroke with the given samples."""
+    coords = []
+    for i in range(samples):
+        t = i / 25.0
+        coords += [seed_x + 300 * math.sin(t * 0.7) + 5 * math.sin(t * 9),
+                   seed_y + 200 * math.cos(t * 0.5) + 5 * math.cos(t * 11)]
+    return coords
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def redraw_time(canvas, repeats=5):
+    # Force Tk to repaint the whole canvas a few times
+    total = 0.0
+    for _ in range(repeats):
+        canvas.xview_scroll(1, "units")
+        start = time.perf_counter()
+        canvas.update()
+        total += time.perf_counter() - start
+        canvas.xview_scroll(-1, "units")
+    return total / repeats
+
+
+def bench_pencil(root, samples=6000):
+    """Old behaviour (one item per motion event) vs. one growing polyline."""
+    coords = scribble(samples)
+    print("pencil stroke, %d motion samples" % samples)
+
+    def per_segment(canvas):
+        for i in range(4, len(coords) + 1, 2):
+            canvas.create_line(coords[i - 4:i], smooth=True)
+
+    def single_polyline(canvas):
+        item = canvas.create_line(coords[:4], smooth=True)
+        for i in range(4, len(coords), 2):
+            canvas.insert(item, "end", coords[i:i + 2])
+
+    for name, draw in (("per-segment", per_segment), ("polyline", single_polyline)):
+        canvas = tk.Canvas(root, width=800, height=600)
+        canvas.pack()
+        build, _ = timed(draw, canvas)
+        canvas.update()
+        redraw = redraw_time(canvas)
+        export, _ = timed(canvas.postscript)
+        print("  %-12s items=%6d  build=%7.1f ms  redraw=%7.2f ms  postscript=%7.1f ms"
+              % (name, len(canvas.find_all()), build * 1e3, redraw * 1e3, export * 1e3))
+        canvas.destroy()
+
+
+def bench_rubber_band(root, events=5000):
+    """Rectangle preview: delete/create per motion event vs. updating coords."""
+    print("rubber-band preview, %d motion events" % events)
+    path = scribble(events)
+
+    def recreate(canvas, x, y, item):
+        if item is not None:
+            canvas.delete(item)
+        return canvas.create_rectangle(10, 10, x, y)
+
+    def reuse(canvas, x, y, item):
+        if item is None:
+            return canvas.create_rectangle(10, 10, x, y)
+        canvas.coords(item, 10, 10, x, y)
+        return item
+
+    for name, step in (("delete/create", recreate), ("coords", reuse)):
+        canvas = tk.Canvas(root, width=800, height=600)
+        canvas.pack()
+        canvas.update()
+        item = None
+        latencies = []
+        for i in range(0, len(path), 2):
+            start = time.perf_counter()
+            item = step(canvas, path[i], path[i + 1], item)
+            canvas.update_idletasks()
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        print("  %-14s mean=%6.1f us  p99=%7.1f us  last item id=%s"
+              % (name, 1e6 * sum(latencies) / len(latencies), 1e6 * latencies[int(len(latencies) * 0.99)], item))
+        canvas.destroy()
+
+
+def sample_document(shapes=2000, seed=1):
+    rng = random.Random(seed)
+    document = Document()
+    for i in range(shapes):
+        x, y = rng.uniform(0, 760), rng.uniform(0, 560)
+        kind = ("line", "rectangle", "oval", "pencil")[i % 4]
+        if kind == "pencil":
+            document.add(Shape("pencil", scribble(50, x, y), color="blue", width=2))
+        else:
+            document.add(Shape(kind, [x, y, x + rng.uniform(5, 40), y + rng.uniform(5, 40)], color="black", width=2))
+    document.add(Shape("text", [400, 300], text="GraphyX", font=("Arial", 24, "bold"), color="red"))
+    return document
+
+
+def bench_export(root, shapes=2000):
+    """canvas.postscript() + Ghostscript vs. rendering the document directly."""
+    document = sample_document(shapes)
+    images = ImageRegistry()
+    print("PNG export, %d shapes" % len(document))
+
+    canvas = tk.Canvas(root, width=800, height=600)
+    canvas.pack()
+    CanvasRenderer(canvas, document, images)
+    canvas.update()
+    fd, ps_file = tempfile.mkstemp(suffix=".ps")
+    os.close(fd)
+
+    def postscript():
+        canvas.postscript(file=ps_file, colormode="color")
+        img = Image.open(ps_file)
+        img.load()
+        return img
+
+    try:
+        elapsed, img = timed(postscript)
+        print("  %-18s %7.1f ms  %dx%d  temp file %d bytes"
+              % ("postscript+gs", elapsed * 1e3, img.width, img.height, os.path.getsize(ps_file)))
+    except OSError as e:
+        print("  %-18s unavailable (%s)" % ("postscript+gs", e))
+    finally:
+        os.remove(ps_file)
+        canvas.destroy()
+
+    for dpi in (96, 300):
+        elapsed, img = timed(render_document, document, images, dpi)
+        print("  %-18s %7.1f ms  %dx%d" % ("native @%d dpi" % dpi, elapsed * 1e3, img.width, img.height))
+
+
+def bench_tiled_export(dpi=1200, shapes=2000):
+    """Whole-image export vs. streaming bands from a process pool (no display needed)."""
+    document = sample_document(shapes)
+    images = ImageRegistry()
+    rect = export_bounds(document)
+    fd, out = tempfile.mkstemp(suffix=".png")
+    os.close(fd)
+    print("PNG export at %d dpi, %d shapes" % (dpi, len(document)))
+
+    # Children first: ru_maxrss of this process only ever grows
+    shapes, paths = snapshot(document, images)
+    elapsed, _ = timed(write_tiled_png, shapes, paths, dpi, rect, out)
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    print("  %-10s %8.1f ms  peak worker rss %6.0f MB  %d bytes"
+          % ("tiled", elapsed * 1e3, peak / 1024, os.path.getsize(out)))
+
+    def whole():
+        render_document(document, images, dpi).save(out, "PNG")
+
+    elapsed, _ = timed(whole)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print("  %-10s %8.1f ms  peak rss        %6.0f MB  %d bytes"
+          % ("in-memory", elapsed * 1e3, peak / 1024, os.path.getsize(out)))
+    os.remove(out)
+
+
+if __name__ == "__main__":
+    bench_tiled_export()
+    root = tk.Tk()
+    bench_pencil(root)
+    bench_rubber_band(root)
+    bench_export(root)
+    root.destroy()
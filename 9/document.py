@@ -0,0 +1,219 @@
+"""Headless document model for GraphyX.
+
+The document owns every shape drawn in the editor together with its style and
+stacking order.  It never touches Tk, so drawings can be queried, saved and
+benchmarked without a display; the canvas only mirrors it (see renderer.py).
+"""
+
+from contextlib import contextmanager
+
+from spatial import QuadTree
+
+
+# Style value meaning "the key is not set", in modify() and in old_style
+ABSENT = object()
+
+
+@contextmanager
+def muted(listener):
+    """Set listener._paused while the block runs, then restore it, so uses can nest."""
+    paused, listener._paused = listener._paused, True
+    try:
+        yield
+    finally:
+        listener._paused = paused
+
+
+class Shape:
+    """A single drawable element stored in plain Python data.
+
+    kind is one of "line", "rectangle", "oval", "pencil", "text" or "image".
+    coords is a flat [x0, y0, x1, y1, ...] list and style holds the drawing
+    options (color, fill, width, font, text, path, size...).
+    """
+
+    def __init__(self, kind, coords, **style):
+        self.id = None
+        self.z = 0
+        self.kind = kind
+        self.coords = [float(c) for c in coords]
+        self.style = style
+
+    def bounds(self):
+        xs = self.coords[0::2]
+        ys = self.coords[1::2]
+        if self.kind == "text":
+            # Rough extent of a centred text item; good enough for picking
+            size = abs(self.style.get("font", ("Arial", 16, ""))[1])
+            half_w = len(self.style.get("text", "")) * size * 0.3
+            half_h = size * 0.65
+            return (xs[0] - half_w, ys[0] - half_h, xs[0] + half_w, ys[0] + half_h)
+        if self.kind == "image":
+            w, h = self.style.get("size", (0, 0))
+            return (xs[0], ys[0], xs[0] + w, ys[0] + h)
+        pad = self.style.get("width", 1) / 2.0
+        return (min(xs) - pad, min(ys) - pad, max(xs) + pad, max(ys) + pad)
+
+    def copy(self):
+        return Shape(self.kind, self.coords, **self.style)
+
+    def __repr__(self):
+        return "Shape(%r, id=%r, z=%r, %d points)" % (self.kind, self.id, self.z, len(self.coords) // 2)
+
+
+def stacking(shape):
+    return (shape.z, shape.id)
+
+
+class Document:
+    """Ordered collection of shapes with change notifications.
+
+    Shapes must only be changed through the methods below, which never alter
+    a coordinate list or style dict in place except to append points (see
+    snapshot).
+
+    Listeners are called as listener(event, shape, **info) where event is one
+    of "add", "remove", "update", "extend" or "raise".
+    """
+
+    def __init__(self):
+        self.shapes = {}  # shape id -> Shape; stacking order is (z, id)
+        self.listeners = []
+        self.index = QuadTree()  # shape id -> bounds, for picking
+        self._next_id = 1
+        self._next_z = 1
+
+    def __iter__(self):
+        return iter(sorted(self.shapes.values(), key=stacking))
+
+    def __len__(self):
+        return len(self.shapes)
+
+    def __contains__(self, shape_id):
+        return shape_id in self.shapes
+
+    def get(self, shape_id):
+        return self.shapes.get(shape_id)
+
+    def add(self, shape, z=None):
+        """Add shape on top, or at level z (above other shapes sharing that z)."""
+        shape.id = self._next_id
+        self._next_id += 1
+        if z is None:
+            z = self._next_z
+            self._next_z += 1
+        shape.z = z
+        self.shapes[shape.id] = shape
+        self.index.insert(shape.id, shape.bounds())
+        self._notify("add", shape)
+        return shape.id
+
+    def insert(self, shape):
+        """Add a shape keeping its own id and z, e.g. when loading a file."""
+        if shape.id in self.shapes:
+            raise ValueError("duplicate shape id %r" % shape.id)
+        self._next_id = max(self._next_id, shape.id + 1)
+        self._next_z = max(self._next_z, shape.z + 1)
+        self.shapes[shape.id] = shape
+        self.index.insert(shape.id, shape.bounds())
+        self._notify("add", shape)
+        return shape.id
+
+    def remove(self, shape_id):
+        shape = self.shapes.pop(shape_id, None)
+        if shape is not None:
+            self.index.remove(shape_id)
+            self._notify("remove", shape)
+        return shape
+
+    def move(self, shape_id, dx, dy):
+        shape = self.shapes[shape_id]
+        old = shape.coords
+        coords = list(old)
+        coords[0::2] = [x + dx for x in old[0::2]]
+        coords[1::2] = [y + dy for y in old[1::2]]
+        shape.coords = coords
+        self.index.update(shape_id, shape.bounds())
+        self._notify("update", shape, old_coords=old, offset=(dx, dy))
+
+    def set_coords(self, shape_id, coords):
+        shape = self.shapes[shape_id]
+        old = shape.coords
+        shape.coords = [float(c) for c in coords]
+        self.index.update(shape_id, shape.bounds())
+        self._notify("update", shape, old_coords=old)
+
+    def extend(self, shape_id, points):
+        """Append points to a pencil stroke without re-sending the whole path."""
+        shape = self.shapes[shape_id]
+        points = [float(c) for c in points]
+        shape.coords.extend(points)
+        pad = shape.style.get("width", 1) / 2.0
+        x1, y1, x2, y2 = self.index.bounds_of(shape_id)
+        xs, ys = points[0::2], points[1::2]
+        self.index.update(shape_id, (min(x1, min(xs) - pad), min(y1, min(ys) - pad),
+                                     max(x2, max(xs) + pad), max(y2, max(ys) + pad)))
+        self._notify("extend", shape, points=points)
+
+    def modify(self, shape_id, **style):
+        """Change style keys; a value of ABSENT removes the key."""
+        shape = self.shapes[shape_id]
+        old = {key: shape.style.get(key, ABSENT) for key in style}
+        shape.style = {key: value for key, value in dict(shape.style, **style).items() if value is not ABSENT}
+        self.index.update(shape_id, shape.bounds())
+        self._notify("update", shape, old_style=old)
+
+    def raise_to_top(self, shape_id):
+        self._next_z += 1
+        self.set_z(shape_id, self._next_z - 1)
+
+    def reserve(self, max_id, max_z):
+        """Keep ids and z levels up to these for shapes that are not loaded yet."""
+        self._next_id = max(self._next_id, max_id + 1)
+        self._next_z = max(self._next_z, max_z + 1)
+
+    def set_z(self, shape_id, z):
+        """Move a shape to stacking level z (notified as "raise")."""
+        shape = self.shapes[shape_id]
+        old_key = stacking(shape)
+        shape.z = z
+        self._next_z = max(self._next_z, z + 1)
+        self._notify("raise", shape, old_key=old_key)
+
+    def snapshot(self):
+        """Copy-on-write view of every shape, cheap enough to take on the Tk thread.
+
+        Returns (id, z, kind, coords, length, style) tuples that share the
+        coordinate lists and style dicts with the live shapes.  Those are
+        never changed in place -- move and modify replace them and extend only
+        appends -- so another thread can read coords[:length] and style while
+        editing goes on.
+        """
+        return [(s.id, s.z, s.kind, s.coords, len(s.coords), s.style) for s in self.shapes.values()]
+
+    def bounds(self):
+        """Bounding box of the whole drawing, or None if it is empty.
+
+        Maintained incrementally by the spatial index, so this is cheap to
+        call on every zoom.
+        """
+        return self.index.extent()
+
+    def find_overlapping(self, rect):
+        """Shapes whose bounds intersect rect, bottom-most first."""
+        return sorted((self.shapes[i] for i in self.index.query(rect)), key=stacking)
+
+    def hit_test(self, x, y, tolerance=0):
+        """Return the topmost shape under (x, y), or None."""
+        hits = self.index.query_point(x, y, tolerance)
+        if not hits:
+            return None
+        return max((self.shapes[i] for i in hits), key=stacking)
+
+    def clear(self):
+        for shape_id in list(self.shapes):
+            self.remove(shape_id)
+
+    def _notify(self, event, shape, **info):
+        for listener in self.listeners:
+            listener(event, shape, **info)
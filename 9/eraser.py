@@ -0,0 +1,78 @@
+"""Geometry for the eraser tool: cut pieces out of polylines."""
+
+from document import Shape
+from spatial import contains
+
+
+def clip_segment(x0, y0, x1, y1, rect):
+    """Liang-Barsky: parameter range (t0, t1) of the segment inside rect, or None."""
+    dx, dy = x1 - x0, y1 - y0
+    t0, t1 = 0.0, 1.0
+    for p, q in ((-dx, x0 - rect[0]), (dx, rect[2] - x0), (-dy, y0 - rect[1]), (dy, rect[3] - y0)):
+        if p == 0:
+            if q < 0:
+                return None
+            continue
+        r = q / p
+        if p < 0:
+            if r > t1:
+                return None
+            t0 = max(t0, r)
+        else:
+            if r < t0:
+                return None
+            t1 = min(t1, r)
+    if t1 <= t0 and (dx or dy):
+        return None  # only grazes a corner
+    return t0, t1
+
+
+def erase_polyline(coords, rect):
+    """Remove the parts of a polyline inside rect.
+
+    Returns None when the polyline does not cross rect at all, otherwise the
+    list of remaining pieces (possibly empty), each a flat coordinate list.
+    """
+    pieces = []
+    touched = False
+    current = [coords[0], coords[1]]
+    for i in range(0, len(coords) - 2, 2):
+        x0, y0, x1, y1 = coords[i:i + 4]
+        clip = clip_segment(x0, y0, x1, y1, rect)
+        if clip is None:
+            if not current:
+                current = [x0, y0]
+            current += [x1, y1]
+            continue
+        touched = True
+        t0, t1 = clip
+        if t0 > 0 and current:
+            current += [x0 + (x1 - x0) * t0, y0 + (y1 - y0) * t0]
+        if len(current) >= 4:
+            pieces.append(current)
+        current = []
+        if t1 < 1:
+            current = [x0 + (x1 - x0) * t1, y0 + (y1 - y0) * t1, x1, y1]
+    if not touched:
+        return None
+    if len(current) >= 4:
+        pieces.append(current)
+    return pieces
+
+
+def erase_rect(document, rect):
+    """Cut strokes and lines of document under rect, delete shapes it fully covers."""
+    for shape in document.find_overlapping(rect):
+        if contains(rect, shape.bounds()):
+            document.remove(shape.id)
+        elif shape.kind in ("pencil", "line"):
+            pad = shape.style.get("width", 1) / 2.0
+            pieces = erase_polyline(shape.coords, (rect[0] - pad, rect[1] - pad, rect[2] + pad, rect[3] + pad))
+            if pieces is None:
+                continue
+            if not pieces:
+                document.remove(shape.id)
+                continue
+            document.set_coords(shape.id, pieces[0])
+            for piece in pieces[1:]:
+                document.add(Shape(shape.kind, piece, **shape.style), z=shape.z)
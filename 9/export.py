@@ -0,0 +1,279 @@
+"""Render a Document straight to a PIL image.
+
+This replaces the canvas.postscript() + Ghostscript round trip: no temporary
+file, no external interpreter, any output resolution, and it only needs the
+document model so it can run without a display.
+"""
+
+import math
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageDraw, ImageFont
+
+from imagery import ImagePyramid
+from pngstream import PNGStreamWriter, compress_rows
+from spatial import QuadTree
+
+SCREEN_DPI = 96  # document units are screen pixels at 100% zoom
+BAND_HEIGHT = 256  # output rows rendered at a time by band-wise exports
+TILED_PIXELS = 4096 * 4096  # larger exports are streamed, see write_tiled_png
+
+
+def export_scale(dpi):
+    return dpi / SCREEN_DPI
+
+
+def export_bounds(document, padding=10):
+    bounds = document.bounds()
+    if bounds is None:
+        return (0, 0, 1, 1)
+    x1, y1, x2, y2 = bounds
+    return (x1 - padding, y1 - padding, x2 + padding, y2 + padding)
+
+
+def output_size(rect, scale):
+    return (max(1, round((rect[2] - rect[0]) * scale)), max(1, round((rect[3] - rect[1]) * scale)))
+
+
+def render_document(document, images, dpi=SCREEN_DPI, rect=None, background="white"):
+    """Rasterize the whole drawing (or the world rect) at the given DPI."""
+    scale = export_scale(dpi)
+    if rect is None:
+        rect = export_bounds(document)
+    return render_region(document.find_overlapping(rect), images, rect, scale, background)
+
+
+def snapshot(document, images):
+    """Picklable copy of what an export needs, so drawing can go on meanwhile.
+
+    Returns the shapes in stacking order and a {asset key: path} dict; the
+    worker reopens the images itself instead of receiving pixel buffers.
+    """
+    shapes = [shape.copy() for shape in document]
+    pyramids = {s.style["asset"]: images.get(s.style["asset"]) for s in shapes if s.kind == "image"}
+    paths = {key: pyramid.path for key, pyramid in pyramids.items() if not pyramid.missing}
+    return shapes, paths
+
+
+class Snapshot:
+    """Frozen shapes with a spatial index, for rendering one band at a time."""
+
+    def __init__(self, shapes, paths):
+        self.shapes = shapes
+        self.images = {key: ImagePyramid(path, key) for key, path in paths.items()}
+        self.index = QuadTree()
+        for i, shape in enumerate(shapes):
+            self.index.insert(i, shape.bounds())
+
+    def find_overlapping(self, rect):
+        return [self.shapes[i] for i in sorted(self.index.query(rect))]
+
+
+def bands(height, band_height=BAND_HEIGHT):
+    return [(top, min(height, top + band_height)) for top in range(0, height, band_height)]
+
+
+def render_band(snap, rect, scale, width, top, bottom, background="white"):
+    """Output rows top..bottom of an export of rect."""
+    band = (rect[0], rect[1] + top / scale, rect[2], rect[1] + bottom / scale)
+    return render_region(snap.find_overlapping(band), snap.images, rect, scale, background, (width, bottom - top), top)
+
+
+def export_worker(shapes, paths, dpi, rect, file_path, progress, cancel):
+    """Render and encode a snapshot in a worker process.
+
+    Reports ("progress", done, total) per band, then ("done", file_path),
+    ("cancelled",) or ("error", message) on the progress queue.  The file is
+    only written once every band is ready, so cancelling leaves nothing behind.
+    Outputs over TILED_PIXELS are handed to write_tiled_png instead.
+    """
+    try:
+        scale = export_scale(dpi)
+        width, height = output_size(rect, scale)
+        if width * height > TILED_PIXELS:
+            report = lambda done, total: progress.put(("progress", done, total))
+            if write_tiled_png(shapes, paths, dpi, rect, file_path, report, cancel.is_set):
+                progress.put(("done", file_path))
+            else:
+                progress.put(("cancelled",))
+            return
+        snap = Snapshot(shapes, paths)
+        img = Image.new("RGB", (width, height))
+        rows = bands(height)
+        for done, (top, bottom) in enumerate(rows, 1):
+            if cancel.is_set():
+                progress.put(("cancelled",))
+                return
+            img.paste(render_band(snap, rect, scale, width, top, bottom), (0, top))
+            progress.put(("progress", done, len(rows)))
+        img.save(file_path, "PNG")
+        progress.put(("progress", len(rows), len(rows)))
+        progress.put(("done", file_path))
+    except Exception as exc:
+        progress.put(("error", str(exc)))
+
+
+_band_snapshot = None  # per pool process, set by _init_band_worker
+
+
+def _init_band_worker(shapes, paths):
+    global _band_snapshot
+    _band_snapshot = Snapshot(shapes, paths)
+
+
+def _encode_band(rect, scale, width, top, bottom, last):
+    return compress_rows(render_band(_band_snapshot, rect, scale, width, top, bottom), last)
+
+
+def write_tiled_png(shapes, paths, dpi, rect, file_path, report=None, cancelled=None, workers=None):
+    """Export a snapshot as a PNG of any size without holding it in memory.
+
+    Bands are rendered and deflated in parallel on a process pool and written
+    out in order as they complete.  At most two bands per worker are in
+    flight, so peak memory is a few bands whatever the output size.
+    report(done, total) is called after each band; if cancelled() turns true
+    the partial file is removed and False is returned.
+    """
+    scale = export_scale(dpi)
+    width, height = output_size(rect, scale)
+    rows = bands(height)
+    workers = workers or os.cpu_count()
+    part_path = file_path + ".part"
+    pool = ProcessPoolExecutor(workers, multiprocessing.get_context("spawn"),
+                               initializer=_init_band_worker, initargs=(shapes, paths))
+    try:
+        with open(part_path, "wb") as f:
+            png = PNGStreamWriter(f, width, height)
+            pending = deque()
+            submitted = 0
+            complete = False
+            for done in range(1, len(rows) + 1):
+                while submitted < len(rows) and len(pending) < 2 * workers:
+                    top, bottom = rows[submitted]
+                    submitted += 1
+                    pending.append(pool.submit(_encode_band, rect, scale, width, top, bottom, submitted == len(rows)))
+                if cancelled is not None and cancelled():
+                    break
+                png.write(*pending.popleft().result())
+                if report is not None:
+                    report(done, len(rows))
+            else:
+                png.close()
+                complete = True
+        if not complete:
+            os.remove(part_path)
+            return False
+        os.replace(part_path, file_path)
+        return True
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+def render_region(shapes, images, rect, scale, background="white", size=None, top=0):
+    """Draw shapes, bottom-most first, into an image covering world rect.
+
+    top skips that many output rows, to render one band of a larger export.
+    """
+    img = Image.new("RGB", size or output_size(rect, scale), background)
+    draw = ImageDraw.Draw(img)
+    # Snap to whole output pixels: PIL's rasterization of fractional
+    # coordinates is not translation invariant, and bands must line up exactly
+    ox, oy = round(rect[0] * scale), round(rect[1] * scale) + top
+
+    def project(coords):
+        return [(math.floor(coords[i] * scale + 0.5) - ox, math.floor(coords[i + 1] * scale + 0.5) - oy)
+                for i in range(0, len(coords), 2)]
+
+    for shape in shapes:
+        style = shape.style
+        color = style.get("color", "black")
+        width = max(1, round(style.get("width", 1) * scale))
+        if shape.kind in ("line", "pencil"):
+            draw.line(project(shape.coords), fill=color, width=width,
+                      joint="curve" if shape.kind == "pencil" else None)
+        elif shape.kind in ("rectangle", "oval"):
+            (x1, y1), (x2, y2) = project(shape.coords)
+            box = (min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+            fill = style.get("fill") or None
+            if shape.kind == "rectangle":
+                draw.rectangle(box, outline=color, fill=fill, width=width)
+            else:
+                draw.ellipse(box, outline=color, fill=fill, width=width)
+        elif shape.kind == "text":
+            draw_text(draw, shape, project(shape.coords)[0], scale)
+        elif shape.kind == "image":
+            paste_image(img, images.get(style["asset"]), shape, (ox, oy), scale)
+    return img
+
+
+# File name suffixes of styled faces: Windows core fonts (arialbd.ttf), then
+# DejaVu/Liberation (DejaVuSans-Bold.ttf) and macOS ("Arial Bold.ttf")
+_FACE_SUFFIXES = {
+    (True, False): ("bd", "-Bold", " Bold"),
+    (False, True): ("i", "-Italic", "-Oblique", " Italic"),
+    (True, True): ("bi", "z", "-BoldItalic", "-BoldOblique", " Bold Italic"),
+}
+
+
+def load_font(family, size, bold=False, italic=False):
+    """(font, bold_face): the closest face found, and whether it is a bold one.
+
+    A missing italic face falls back to the upright one, a missing bold face
+    to the regular one (draw_text then emboldens it).
+    """
+    names = (family, family.lower(), family.lower().replace(" ", ""))
+    faces = [(bold, italic), (bold, False), (False, False)]
+    for face in dict.fromkeys(faces):
+        for suffix in _FACE_SUFFIXES.get(face, ("",)):
+            for name in names:
+                try:
+                    return ImageFont.truetype(name + suffix + ".ttf", size), face[0]
+                except OSError:
+                    pass
+    return ImageFont.load_default(size), False
+
+
+def draw_text(draw, shape, position, scale):
+    family, size, weight = shape.style.get("font", ("Arial", 16, ""))
+    size = max(1, round(size * scale))
+    bold, italic = "bold" in weight, "italic" in weight
+    font, bold_face = load_font(family, size, bold, italic)
+    color = shape.style.get("color", "black")
+    text = shape.style.get("text", "")
+    # Without a bold face, embolden the regular one with an outline of the same colour
+    stroke = max(1, round(size / 24)) if bold and not bold_face else 0
+    # Tk centres text items on their anchor point
+    draw.text(position, text, fill=color, font=font, anchor="mm", stroke_width=stroke, stroke_fill=color)
+    if "underline" in weight:
+        x1, y1, x2, y2 = draw.textbbox(position, text, font=font, anchor="mm", stroke_width=stroke)
+        draw.line((x1, y2 + 1, x2, y2 + 1), fill=color, width=max(1, round(scale)))
+
+
+def paste_image(img, pyramid, shape, origin, scale):
+    # Resample the part of the image that falls inside img, from the pyramid
+    # level closest to (but not coarser than) the output resolution; images
+    # whose file is missing are left out
+    if pyramid is None or pyramid.missing:
+        return
+    x, y = shape.coords
+    w, h = pyramid.size
+    ox, oy = origin
+    left, top = max(0, round(x * scale) - ox), max(0, round(y * scale) - oy)
+    right, bottom = min(img.width, round((x + w) * scale) - ox), min(img.height, round((y + h) * scale) - oy)
+    if left >= right or top >= bottom:
+        return
+    level = pyramid.level_for(scale)
+    factor = scale / 2 ** level  # output pixels per level pixel
+    sx, sy = round(x * scale) - ox, round(y * scale) - oy
+    src = pyramid.level(level)
+    box = ((left - sx) / factor, (top - sy) / factor,
+           min(src.width, (right - sx) / factor), min(src.height, (bottom - sy) / factor))
+    part = src.resize((right - left, bottom - top), box=box)
+    img.paste(part, (left, top), part if part.mode == "RGBA" else None)
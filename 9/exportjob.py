@@ -0,0 +1,53 @@
+"""Run exports in a separate process so the editor stays responsive."""
+
+import multiprocessing
+import queue
+
+from export import export_worker, snapshot
+
+
+class ExportJob:
+    """Render and encode a snapshot of the document in a worker process.
+
+    Rasterizing and PNG encoding are CPU bound pure Python/PIL work, so a
+    process (not a thread) keeps them from competing with Tk for the GIL.
+    The document is copied when the job starts and later edits do not affect
+    the file being written.  callback(kind, *payload) is called from the Tk
+    main loop with the messages listed in export.export_worker.
+    """
+
+    def __init__(self, widget, document, images, dpi, rect, file_path, callback, poll_ms=50):
+        self.widget = widget
+        self.callback = callback
+        self.poll_ms = poll_ms
+        # spawn rather than fork: forking a process that runs Tk is unsafe
+        context = multiprocessing.get_context("spawn")
+        self.progress = context.Queue()
+        self.cancelled = context.Event()
+        shapes, paths = snapshot(document, images)
+        # not a daemon: large exports start their own pool of band renderers
+        self.process = context.Process(target=export_worker,
+                                       args=(shapes, paths, dpi, rect, file_path, self.progress, self.cancelled))
+        self.process.start()
+        self.finished = False
+        self.widget.after(self.poll_ms, self._poll)
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def _poll(self):
+        while not self.finished:
+            try:
+                message = self.progress.get_nowait()
+            except queue.Empty:
+                break
+            if message[0] != "progress":
+                self.finished = True
+            self.callback(*message)
+        if not self.finished and not self.process.is_alive() and self.progress.empty():
+            self.finished = True
+            self.callback("error", "export process exited with code %s" % self.process.exitcode)
+        if self.finished:
+            self.process.join()
+        else:
+            self.widget.after(self.poll_ms, self._poll)
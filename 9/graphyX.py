@@ -1,15 +1,48 @@
+import math
+import os
 import tkinter as tk
 from tkinter import simpledialog, filedialog, colorchooser, font
 from tkinter import ttk
-from PIL import Image, ImageTk
+
+from autosave import Autosaver
+from document import Document, Shape
+from eraser import erase_rect
+from export import SCREEN_DPI, export_bounds
+from exportjob import ExportJob
+from history import History
+from imagery import ImageRegistry
+from journal import Journal, new_checkpoint, read_journal
+from loader import ImageLoader
+from project import EXTENSION as PROJECT_EXTENSION, ProjectFile, save_project
+from renderer import CanvasRenderer
+from scheduler import MotionCoalescer
+from simplify import simplify_stroke
+from spatial import union
+
+AUTOSAVE_PATH = os.path.join(os.path.expanduser("~"), ".graphyx-autosave" + PROJECT_EXTENSION)
+
 
 class GraphicsEditor:
     def __init__(self, root):
         self.root = root
         self.root.title("GraphyX - Graphics Editor")
-        self.canvas = tk.Canvas(root, bg="white", width=800, height=600)
+        self.canvas = tk.Canvas(root, bg="white", width=800, height=600, confine=False)
         self.canvas.pack(fill=tk.BOTH, expand=True)
 
+        # Document model; the canvas only mirrors it
+        self.document = Document()
+        self.images = ImageRegistry()
+        self.renderer = CanvasRenderer(self.canvas, self.document, self.images)
+        self.loader = ImageLoader(self.root, self.on_image_loaded)
+        self.renderer.on_missing_level = self.load_finer_level
+        self.renderer.on_region = self.load_region
+        self.project = None  # open ProjectFile whose chunks are still being paged in
+        self.journal = Journal(self.document)
+        self.autosave = Autosaver(self.root, self.document, AUTOSAVE_PATH, self.on_autosaved)
+        self.autosave.context = self.autosave_context
+        self.history = History(self.document)
+        self.document.listeners.append(self.on_document_change)
+
         # Initialize tools and state
         self.current_tool = None
         self.start_x = None
@@ -18,7 +51,12 @@ class GraphicsEditor:
         self.pencil_coords = []
         self.current_color = "black"  # Default color
         self.zoom_level = 1.0
-        self.image = None  # Placeholder for imported image
+        self.simplify_tolerance = 1.0  # in screen pixels, see on_release
+        self.eraser_size = 10  # half the side of the eraser square, in screen pixels
+        self.export_dpi = SCREEN_DPI
+        self.export_job = None
+        self.selected = None  # id of the selected shape
+        self.clipboard = None
 
         self.init_ui()
 
@@ -40,6 +78,12 @@ class GraphicsEditor:
             ("Save", self.save_canvas),
             ("Load", self.load_canvas),
             ("Zoom", self.select_zoom_tool),
+            ("Select", self.select_item_tool),
+            ("Copy", self.copy_item),
+            ("Paste", self.paste_item),
+            ("Delete", self.delete_item),
+            ("Undo", self.undo),
+            ("Redo", self.redo),
         ]
         for text, command in tools:
             btn = tk.Button(toolbar, text=text, command=command)
@@ -53,12 +97,27 @@ class GraphicsEditor:
         self.zoom_slider.pack(side=tk.LEFT, padx=2, pady=2)
         zoom_in_btn = tk.Button(toolbar, text=" + ", command=self.zoom_in)
         zoom_in_btn.pack(side=tk.LEFT, padx=2, pady=2)
-        
+        fit_btn = tk.Button(toolbar, text="Fit", command=self.zoom_to_fit)
+        fit_btn.pack(side=tk.LEFT, padx=2, pady=2)
+
+        # Status bar
+        self.status = tk.Label(self.root, anchor="w", bg="lightgray")
+        self.status.pack(side=tk.BOTTOM, fill=tk.X)
 
         # Bind events
         self.canvas.bind("<Button-1>", self.on_click)
         self.canvas.bind("<B1-Motion>", self.on_drag)
         self.canvas.bind("<ButtonRelease-1>", self.on_release)
+        self.motion = MotionCoalescer(self.canvas, self.apply_drag)
+        self.root.bind("<Control-z>", lambda event: self.undo())
+        self.root.bind("<Control-y>", lambda event: self.redo())
+        self.root.bind("<Control-Z>", lambda event: self.redo())  # Ctrl+Shift+Z
+        self.root.bind("<Control-c>", lambda event: self.copy_item())
+        self.root.bind("<Control-v>", lambda event: self.paste_item())
+        self.root.bind("<Delete>", lambda event: self.delete_item())
+
+    def set_status(self, message):
+        self.status.config(text=message)
 
     def select_tool(self, tool):
         self.current_tool = tool
@@ -90,79 +149,387 @@ class GraphicsEditor:
     def select_zoom_tool(self):
         self.select_tool("zoom")
 
+    def select_item_tool(self):
+        self.select_tool("select")
+
+    def select(self, shape_id):
+        self.selected = shape_id
+        self.update_selection()
+
+    def update_selection(self):
+        # Dashed box around the selected shape, kept above everything else
+        self.canvas.delete("selection")
+        shape = self.document.get(self.selected) if self.selected is not None else None
+        if shape is None:
+            self.selected = None
+            return
+        x1, y1, x2, y2 = self.renderer.view.to_canvas(shape.bounds())
+        self.canvas.create_rectangle(x1 - 3, y1 - 3, x2 + 3, y2 + 3, outline="red", dash=(4, 2), tags="selection")
+
+    def on_document_change(self, event, shape, **info):
+        if shape.kind == "image" and event in ("add", "remove"):
+            # Decoded pixels are only kept for images that some shape shows
+            if event == "add":
+                self.images.acquire(shape.style["asset"])
+                self.request_image(self.images.get(shape.style["asset"]))
+            else:
+                self.images.release(shape.style["asset"])
+        if shape.id == self.selected:
+            self.update_selection()
+        elif self.selected is not None and event in ("add", "raise"):
+            self.canvas.tag_raise("selection")
+
+    def copy_item(self):
+        if self.selected is not None:
+            self.clipboard = self.document.get(self.selected).copy()
+
+    def paste_item(self):
+        # Each paste lands 20 px further from the original
+        if self.clipboard is not None:
+            self.clipboard.coords = [c + 20 for c in self.clipboard.coords]
+            shape = self.clipboard.copy()
+            if shape.kind == "image" and shape.style["asset"] not in self.images and not self.reopen_image(shape):
+                # Copied from a document that has been closed since
+                self.set_status("%s is missing" % shape.style["path"])
+            self.select(self.document.add(shape))
+
+    def delete_item(self):
+        if self.selected is not None:
+            self.document.remove(self.selected)
+
+    def undo(self):
+        if not self.history.undo():
+            self.set_status("Nothing to undo")
+
+    def redo(self):
+        if not self.history.redo():
+            self.set_status("Nothing to redo")
+
     def choose_color(self):
         color = colorchooser.askcolor(title="Choose a color")[1]
         if color:
             self.current_color = color
+            if self.selected is not None:
+                self.document.modify(self.selected, color=color)
 
     def import_image(self):
-        file_path = filedialog.askopenfilename(filetypes=[("Image Files", "*.png;*.jpg;*.jpeg")])
-        if file_path:
-            img = Image.open(file_path)
-            self.image = ImageTk.PhotoImage(img)
-            self.canvas.create_image(0, 0, anchor="nw", image=self.image)
+        file_paths = filedialog.askopenfilenames(filetypes=[("Image Files", "*.png;*.jpg;*.jpeg")])
+        # One undo step for the whole batch
+        self.history.begin()
+        try:
+            for i, file_path in enumerate(file_paths):
+                self.add_image(file_path, 20 * i, 20 * i)
+        finally:
+            self.history.end()
+
+    def add_image(self, file_path, x, y):
+        # Only the header is read here; hashing and decoding happen on the loader's threads
+        try:
+            pyramid = self.images.open(file_path)
+        except OSError as e:
+            self.set_status("Could not load %s: %s" % (file_path, e))
+            return
+        self.document.add(Shape("image", (x, y), asset=pyramid.key, path=file_path, size=pyramid.size))
+        if self.loader.pending:
+            self.set_status("Loading %d image(s)..." % self.loader.pending)
+
+    def request_image(self, pyramid):
+        if pyramid.missing:
+            return
+        if pyramid.content is None:
+            # Duplicates are only known once hashed, see on_image_loaded
+            self.loader.identify(pyramid)
+        elif not pyramid.ready:
+            # Decode no finer than the current zoom needs
+            self.loader.load(pyramid, pyramid.level_for(self.zoom_level))
+
+    def load_finer_level(self, pyramid, level):
+        self.loader.load(pyramid, level, pyramid.finest() - 1)
+
+    def on_image_loaded(self, key, kind, payload):
+        if key not in self.images or not self.images.in_use(key):
+            return  # from a document that has been closed since, or a deleted image
+        if kind == "hashed":
+            pyramid = self.images.resolve(key, payload)
+            if pyramid.ready:
+                # A copy of an image that is already loaded
+                self.renderer.image_changed(key)
+            else:
+                self.request_image(pyramid)
+            return
+        pyramid = self.images.get(key)
+        if kind == "error":
+            for shape in list(self.document):
+                if shape.kind == "image" and self.images.get(shape.style["asset"]) is pyramid:
+                    self.document.remove(shape.id)
+            self.set_status("Could not load %s: %s" % (pyramid.path, payload))
+            return
+        if kind == "preview":
+            pyramid.preview = payload
+        else:
+            pyramid.install(payload)
+            self.images.trim()
+            self.set_status("Loading %d image(s)..." % self.loader.pending if self.loader.pending else "Images loaded")
+        self.renderer.image_changed(key)
 
     def save_canvas(self):
-        file_path = filedialog.asksaveasfilename(defaultextension=".png", filetypes=[("PNG Files", "*.png")])
-        if file_path:
-            ps_file = "temp.ps"
-            self.canvas.postscript(file = ps_file, colormode = 'color')
-            
-            img = Image.open(ps_file)
-            img.save(file_path, "PNG")
-
+        file_path = filedialog.asksaveasfilename(defaultextension=PROJECT_EXTENSION, filetypes=[
+            ("GraphyX Project", "*" + PROJECT_EXTENSION), ("PNG Files", "*.png")])
+        if not file_path:
+            return
+        if file_path.lower().endswith(PROJECT_EXTENSION):
+            self.save_project(file_path)
+        else:
+            dpi = simpledialog.askinteger("Export", "Resolution (DPI):", initialvalue=self.export_dpi, minvalue=1, maxvalue=2400)
+            if dpi is None:
+                return
+            self.export_dpi = dpi
+            self.start_export(file_path, dpi)
+
+    def start_export(self, file_path, dpi):
+        # One export at a time; the dialog is not modal so drawing can go on
+        if self.export_job is not None:
+            self.set_status("An export is already running")
+            return
+        self.load_region(None)
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Exporting")
+        dialog.resizable(False, False)
+        tk.Label(dialog, text="Exporting %s at %d DPI" % (os.path.basename(file_path), dpi)).pack(padx=10, pady=(10, 4))
+        bar = ttk.Progressbar(dialog, length=300, mode="determinate")
+        bar.pack(padx=10, pady=4)
+        tk.Button(dialog, text="Cancel", command=lambda: self.export_job.cancel()).pack(pady=(4, 10))
+        dialog.protocol("WM_DELETE_WINDOW", lambda: self.export_job.cancel())
+
+        def on_progress(kind, *payload):
+            if kind == "progress":
+                done, total = payload
+                bar.config(maximum=total, value=done)
+                return
+            dialog.destroy()
+            self.export_job = None
+            if kind == "done":
+                self.set_status("Exported %s" % payload[0])
+            elif kind == "cancelled":
+                self.set_status("Export cancelled")
+            else:
+                self.set_status("Export failed: %s" % payload[0])
+
+        self.export_job = ExportJob(self.root, self.document, self.images, dpi,
+                                    export_bounds(self.document), file_path, on_progress)
+        self.set_status("Exporting %s..." % file_path)
+
+    def save_project(self, file_path):
+        # Saving over the open project only appends the edits to its journal,
+        # until the journal is big enough to be worth compacting
+        try:
+            if self.journal.can_append(file_path):
+                added = self.journal.append()
+                self.set_status("Saved %s (%d bytes journaled)" % (file_path, added))
+                return
+            # Everything must be in memory before the file (maybe the mapped one) is replaced
+            self.load_region(None)
+            checkpoint = new_checkpoint()
+            save_project(self.document, file_path, self.current_view(), checkpoint)
+            self.journal.start(file_path, checkpoint)
+        except OSError as e:
+            self.set_status("Could not save %s: %s" % (file_path, e))
+            return
+        self.set_status("Saved %s" % file_path)
+
+    def current_view(self):
+        x1, y1, x2, y2 = self.renderer.viewport()
+        return {"scale": self.zoom_level, "center": [(x1 + x2) / 2, (y1 + y2) / 2]}
+
+    def autosave_context(self):
+        # Shapes of the open project that are not paged in yet are merged in
+        # by the autosave thread itself
+        source = self.project.path if self.project is not None else None
+        return source, self.journal.removed, self.current_view()
+
+    def on_autosaved(self, kind, *payload):
+        if kind == "saved":
+            path, seconds, size = payload
+            self.set_status("Autosaved to %s (%.1f MB) in %d ms" % (path, size / 1e6, seconds * 1000))
+        else:
+            self.set_status("Autosave failed: %s" % payload[0])
 
     def load_canvas(self):
-        file_path = filedialog.askopenfilename(filetypes=[("Image Files", "*.png;*.jpg;*.jpeg")])
-        if file_path:
-            self.canvas.delete("all")
-            img = Image.open(file_path)
-            self.image = ImageTk.PhotoImage(img)
-            self.canvas.create_image(0, 0, anchor="nw", image=self.image)
+        file_path = filedialog.askopenfilename(filetypes=[
+            ("GraphyX Project", "*" + PROJECT_EXTENSION), ("Image Files", "*.png;*.jpg;*.jpeg")])
+        if not file_path:
+            return
+        if file_path.lower().endswith(PROJECT_EXTENSION):
+            self.load_project(file_path)
+        else:
+            self.close_project()
+            self.document.clear()
+            self.images.clear()
+            self.journal.detach()
+            self.history.clear()
+            self.add_image(file_path, 0, 0)
+
+    def load_project(self, file_path):
+        # Only the header is read here; shapes are paged in by load_region as
+        # the renderer needs them, starting with the saved view
+        try:
+            project = ProjectFile(file_path)
+            project.apply(*read_journal(file_path, project.checkpoint))
+        except (OSError, ValueError) as e:
+            self.set_status("Could not open %s: %s" % (file_path, e))
+            return
+        self.close_project()
+        with self.autosave.paused():
+            # What is opened is already on disk
+            self.document.clear()
+        self.images.clear()
+        self.document.reserve(project.max_id, project.max_z)
+        self.journal.attach(file_path, project.checkpoint)
+        self.history.clear()
+        if project.view:
+            # Set up the view before paging is enabled so nothing else is decoded
+            self.zoom_level = project.view["scale"]
+            self.update_canvas_scale()
+            self.renderer.center_on(*project.view["center"])
+        self.project = project
+        self.missing_images = 0
+        if project.bounds is None:
+            self.load_region(None)  # version 1 files have no chunk index
+        if project.view:
+            self.update_scrollregion()
+        else:
+            self.zoom_to_fit()
+        self.renderer.refresh(force=True)
+        self.set_status("Opened %s" % file_path)
+
+    def load_region(self, rect):
+        """Decode the part of the open project around rect (everything if None)."""
+        if self.project is None:
+            return
+        with self.journal.paused(), self.history.paused(), self.autosave.paused():
+            for shape in self.project.read(rect):
+                if shape.kind == "image" and not self.reopen_image(shape):
+                    # Kept as a placeholder so that saving does not drop it
+                    self.missing_images += 1
+                    self.set_status("%d image(s) of %s are missing" % (self.missing_images, self.project.path))
+                self.document.insert(shape)
+        if self.project.done:
+            self.close_project()
+
+    def close_project(self):
+        if self.project is not None:
+            self.project.close()
+            self.project = None
+
+    def drawing_bounds(self):
+        # Includes the parts of an open project that are not loaded yet
+        return union(self.document.bounds(), self.project.bounds if self.project else None)
+
+    def reopen_image(self, shape):
+        # Projects reference images by path; the file may have moved or changed.
+        # A missing file gets a placeholder with the saved size and False is returned
+        try:
+            pyramid = self.images.open(shape.style["path"])
+        except OSError:
+            pyramid = self.images.missing(shape.style["path"], shape.style["size"])
+        shape.style.update(asset=pyramid.key, size=pyramid.size)
+        return not pyramid.missing
+
+    def to_world(self, event):
+        # Window pixels -> scrolled canvas -> document coordinates
+        return self.renderer.view.to_world(self.canvas.canvasx(event.x), self.canvas.canvasy(event.y))
 
     def on_click(self, event):
-        self.start_x, self.start_y = event.x, event.y
-        if self.current_tool == "text":
-            self.add_text(event.x, event.y)
+        x, y = self.to_world(event)
+        self.start_x, self.start_y = x, y
+        # Everything done until the button is released is one undo step
+        self.history.begin()
+        if self.current_tool == "zoom":
+            self.canvas.scan_mark(event.x, event.y)
+        elif self.current_tool == "select":
+            shape = self.document.hit_test(x, y, 3 / self.zoom_level)
+            self.select(shape.id if shape else None)
+        elif self.current_tool == "text":
+            self.add_text(x, y)
+        elif self.current_tool == "pencil":
+            self.pencil_coords = [x, y]
+        elif self.current_tool == "eraser":
+            self.erase_at(x, y)
 
     def on_drag(self, event):
+        # Motion fires faster than the screen refreshes; handle it once per frame
+        self.motion.push(event)
+
+    def apply_drag(self, events):
+        event = events[-1]
         if self.current_tool == "zoom":
-            dx = event.x - self.start_x
-            dy = event.y - self.start_y
-            self.canvas.scan_dragto(-dx, -dy, gain=1)
-            self.start_x, self.start_y = event.x, event.y
+            self.canvas.scan_dragto(event.x, event.y, gain=1)
+            self.renderer.refresh()
         else:
-            if self.current_tool == "line" and self.start_x and self.start_y:
-                self.canvas.delete(self.current_item)
-                self.current_item = self.canvas.create_line(
-                    self.start_x, self.start_y, event.x, event.y, fill=self.current_color
-                )
-            elif self.current_tool == "rectangle" and self.start_x and self.start_y:
-                self.canvas.delete(self.current_item)
-                self.current_item = self.canvas.create_rectangle(
-                    self.start_x, self.start_y, event.x, event.y, outline=self.current_color
-                )
-            elif self.current_tool == "ellipse" and self.start_x and self.start_y:
-                self.canvas.delete(self.current_item)
-                self.current_item = self.canvas.create_oval(
-                    self.start_x, self.start_y, event.x, event.y, outline=self.current_color
-                )
+            x, y = self.to_world(event)
+            kinds = {"line": "line", "rectangle": "rectangle", "ellipse": "oval"}
+            if self.current_tool in kinds and self.start_x is not None:
+                coords = (self.start_x, self.start_y, x, y)
+                if self.current_item:
+                    # Reuse the preview item, only its coordinates change
+                    self.document.set_coords(self.current_item, coords)
+                else:
+                    self.current_item = self.document.add(
+                        Shape(kinds[self.current_tool], coords, color=self.current_color)
+                    )
             elif self.current_tool == "pencil":
-                if len(self.pencil_coords) >= 4:
-                    self.canvas.create_line(self.pencil_coords[-4:], fill=self.current_color, smooth=True)
-                self.pencil_coords += [event.x, event.y]
+                # One polyline per stroke, extended in place with every sample
+                points = []
+                for e in events:
+                    points += self.to_world(e)
+                self.pencil_coords += points
+                if self.current_item:
+                    self.document.extend(self.current_item, points)
+                elif len(self.pencil_coords) >= 4:
+                    self.current_item = self.document.add(
+                        Shape("pencil", self.pencil_coords, color=self.current_color)
+                    )
             elif self.current_tool == "eraser":
-                size = 10
-                x1, y1 = event.x - size, event.y - size
-                x2, y2 = event.x + size, event.y + size
-                self.canvas.create_rectangle(x1, y1, x2, y2, fill="white", outline="white")
+                self.erase_along(self.start_x, self.start_y, x, y)
+                self.start_x, self.start_y = x, y
+            elif self.current_tool == "select" and self.selected is not None:
+                self.document.move(self.selected, x - self.start_x, y - self.start_y)
+                self.start_x, self.start_y = x, y
 
     def on_release(self, event):
-        if self.current_tool in ["pencil", "eraser"]:
-            self.pencil_coords = []
-        else:
+        try:
+            self.motion.flush()
+            if self.current_tool == "pencil" and self.current_item:
+                self.commit_stroke(self.current_item)
+        finally:
+            # Close the gesture's undo step whatever happened during it
+            if self.current_tool in ["pencil", "eraser"]:
+                self.pencil_coords = []
             self.current_item = None
             self.start_x, self.start_y = None, None
+            self.history.end()
+
+    def commit_stroke(self, shape_id):
+        # Simplify to within a screen pixel at the current zoom
+        coords = self.document.get(shape_id).coords
+        simplified = simplify_stroke(coords, self.simplify_tolerance / self.zoom_level)
+        self.document.set_coords(shape_id, simplified)
+        before, after = len(coords) // 2, len(simplified) // 2
+        self.set_status("Stroke simplified: %d -> %d points (%.0f%% fewer)"
+                        % (before, after, 100.0 * (before - after) / before))
+
+    def erase_along(self, x0, y0, x1, y1):
+        # Step the eraser square along the drag so fast moves leave no gaps
+        size = self.eraser_size / self.zoom_level
+        steps = max(1, int(math.hypot(x1 - x0, y1 - y0) / size))
+        for i in range(1, steps + 1):
+            t = i / steps
+            self.erase_at(x0 + (x1 - x0) * t, y0 + (y1 - y0) * t)
+
+    def erase_at(self, x, y):
+        """Cut strokes and lines under the eraser, delete shapes it fully covers."""
+        size = self.eraser_size / self.zoom_level
+        erase_rect(self.document, (x - size, y - size, x + size, y + size))
 
     def zoom_in(self):
         if self.zoom_level < 5.0:  # Limit zoom in
@@ -180,10 +547,29 @@ class GraphicsEditor:
         self.update_canvas_scale()
 
     def update_canvas_scale(self):
-        self.canvas.scale("all", 0, 0, self.zoom_level, self.zoom_level)
-        self.canvas.configure(scrollregion=self.canvas.bbox("all"))
+        # Absolute zoom: shapes are re-projected from world coordinates
+        self.renderer.zoom(self.zoom_level)
+        self.update_selection()
+        self.update_scrollregion()
         self.zoom_slider.set(self.zoom_level * 100)
 
+    def update_scrollregion(self):
+        bounds = self.drawing_bounds()
+        if bounds:
+            self.canvas.configure(scrollregion=self.renderer.view.to_canvas(bounds))
+
+    def zoom_to_fit(self):
+        bounds = self.drawing_bounds()
+        if not bounds:
+            return
+        x1, y1, x2, y2 = bounds
+        width = max(x2 - x1, 1)
+        height = max(y2 - y1, 1)
+        scale = min(self.canvas.winfo_width() / width, self.canvas.winfo_height() / height)
+        self.zoom_level = min(5.0, max(0.2, scale))
+        self.update_canvas_scale()
+        self.renderer.center_on((x1 + x2) / 2, (y1 + y2) / 2)
+
     def add_text(self, x, y):
         dialog = tk.Toplevel(self.root)
         dialog.title("Insert Text")
@@ -223,10 +609,8 @@ class GraphicsEditor:
                     style += " italic"
                 if underline_var.get():
                     style += " underline"
-                selected_font = font.Font(
-                    family=font_family.get(), size=int(font_size.get()), weight="bold" if "bold" in style else "normal", slant="italic" if "italic" in style else "roman", underline=underline_var.get()
-                )
-                self.canvas.create_text(x, y, text=text, fill=self.current_color, font=selected_font)
+                selected_font = (font_family.get(), int(font_size.get()), style.strip())
+                self.document.add(Shape("text", (x, y), text=text, color=self.current_color, font=selected_font))
             dialog.destroy()
 
         # Buttons
@@ -0,0 +1,224 @@
+"""Undo/redo history of document edits."""
+
+import time
+from collections import deque
+
+from document import ABSENT, Shape, muted
+
+MERGE_SECONDS = 1.0  # successive moves of the same shapes this close become one step
+
+
+def clone(shape):
+    copy = Shape(shape.kind, shape.coords, **shape.style)
+    copy.id, copy.z = shape.id, shape.z
+    return copy
+
+
+def op_size(op):
+    # Rough bytes held by an operation: the coordinate lists dominate
+    size = 100
+    for part in op[2:]:
+        if isinstance(part, list):
+            size += 8 * len(part)
+        elif isinstance(part, Shape):
+            size += 100 + 8 * len(part.coords)
+    return size
+
+
+class Step:
+    """The operations of one undoable action, in the order they happened."""
+
+    def __init__(self):
+        self.ops = []
+        self.last = {}  # shape id -> index of its latest op, for merging
+        self.coords = {}  # shape id -> its coords op whose new coordinates are not known yet
+        self.size = 0
+        self.time = 0.0
+
+    def moves_only(self):
+        return self.ops and all(op[0] == "move" for op in self.ops)
+
+
+class History:
+    """Command-based undo stack fed by the document's change events.
+
+    Every edit between begin() and end() -- one mouse gesture, one dialog --
+    becomes a single step; edits made outside a gesture are a step each.
+    Steps hold small deltas rather than snapshots: a move keeps only its
+    offset, a coordinate or style change keeps what it replaced (the document
+    never changes those in place), and a shape created in a step is captured
+    once when the step closes, so a stroke drawn with thousands of extend
+    events costs one copy of the final stroke.
+
+    The history is kept within budget bytes: quick successive moves of the
+    same shapes are merged into one step, and the oldest steps are dropped
+    when the estimate goes over.
+    """
+
+    def __init__(self, document, budget=16 << 20):
+        self.document = document
+        self.budget = budget
+        self.undo_steps = deque()
+        self.redo_steps = []
+        self.size = 0
+        self.step = None
+        self.depth = 0
+        self._paused = False
+        document.listeners.append(self.on_change)
+
+    def paused(self):
+        """Ignore document events, e.g. while a file is being loaded or a step replayed."""
+        return muted(self)
+
+    def begin(self):
+        self.depth += 1
+        if self.step is None:
+            self.step = Step()
+
+    def end(self):
+        self.depth = max(0, self.depth - 1)
+        if self.depth == 0 and self.step is not None:
+            step, self.step = self.step, None
+            self._close(step)
+
+    def clear(self):
+        self.undo_steps.clear()
+        self.redo_steps = []
+        self.size = 0
+
+    def on_change(self, event, shape, **info):
+        if self._paused:
+            return
+        if self.step is None:
+            self.begin()
+            self._record(event, shape, info)
+            self.end()
+        else:
+            self._record(event, shape, info)
+
+    def _record(self, event, shape, info):
+        step = self.step
+        index = step.last.get(shape.id)
+        prev = step.ops[index] if index is not None else None
+        if prev is not None and prev[0] == "create":
+            if event == "remove":
+                step.ops[index] = None  # created and deleted within the step
+                del step.last[shape.id]
+            return  # otherwise captured as a whole when the step closes
+        pending = step.coords.get(shape.id)
+        if pending is not None and (event == "remove" or "offset" in info):
+            # The coordinates are about to move or go away: keep them as they are now
+            pending[3] = list(info["old_coords"] if "offset" in info else shape.coords)
+            del step.coords[shape.id]
+        if event == "add":
+            op = ["create", shape.id, None]
+        elif event == "remove":
+            op = ["delete", shape.id, shape]
+        elif event == "raise":
+            if prev is not None and prev[0] == "z":
+                prev[3] = shape.z
+                return
+            op = ["z", shape.id, info["old_key"][0], shape.z]
+        elif "offset" in info:
+            dx, dy = info["offset"]
+            if prev is not None and prev[0] == "move":
+                prev[2] += dx
+                prev[3] += dy
+                return
+            op = ["move", shape.id, dx, dy]
+        elif "old_style" in info:
+            new = {key: shape.style.get(key, ABSENT) for key in info["old_style"]}
+            if prev is not None and prev[0] == "style":
+                for key, value in info["old_style"].items():
+                    prev[2].setdefault(key, value)
+                prev[3].update(new)
+                return
+            op = ["style", shape.id, dict(info["old_style"]), new]
+        else:
+            # update with old_coords, or extend: remember the coordinates before
+            if prev is not None and prev[0] == "coords":
+                return  # the new coordinates are read when the step closes
+            if event == "extend":
+                old = shape.coords[:len(shape.coords) - len(info["points"])]
+            else:
+                old = info["old_coords"]
+            op = ["coords", shape.id, old, None]
+            step.coords[shape.id] = op
+        step.last[shape.id] = len(step.ops)
+        step.ops.append(op)
+
+    def _close(self, step):
+        step.ops = [op for op in step.ops if op is not None]
+        for op in step.ops:
+            if op[0] == "create":
+                op[2] = clone(self.document.get(op[1]))
+            elif op[0] == "coords" and op[3] is None:
+                op[3] = list(self.document.get(op[1]).coords)
+        if not step.ops:
+            return
+        step.size = sum(op_size(op) for op in step.ops)
+        step.time = time.monotonic()
+        self.redo_steps = []
+        last = self.undo_steps[-1] if self.undo_steps else None
+        if (last is not None and step.moves_only() and last.moves_only()
+                and step.time - last.time < MERGE_SECONDS
+                and [op[1] for op in step.ops] == [op[1] for op in last.ops]):
+            for mine, theirs in zip(step.ops, last.ops):
+                theirs[2] += mine[2]
+                theirs[3] += mine[3]
+            last.time = step.time
+            return
+        self.undo_steps.append(step)
+        self.size += step.size
+        while self.size > self.budget and len(self.undo_steps) > 1:
+            self.size -= self.undo_steps.popleft().size
+
+    def undo(self):
+        """Revert the latest step; returns False if there is nothing to undo."""
+        if self.step is not None or not self.undo_steps:
+            return False
+        step = self.undo_steps.pop()
+        self.size -= step.size
+        doc = self.document
+        with self.paused():
+            for op in reversed(step.ops):
+                kind, shape_id = op[0], op[1]
+                if kind == "create":
+                    doc.remove(shape_id)
+                elif kind == "delete":
+                    doc.insert(clone(op[2]))
+                elif kind == "move":
+                    doc.move(shape_id, -op[2], -op[3])
+                elif kind == "coords":
+                    doc.set_coords(shape_id, op[2])
+                elif kind == "style":
+                    doc.modify(shape_id, **op[2])
+                elif kind == "z":
+                    doc.set_z(shape_id, op[2])
+        self.redo_steps.append(step)
+        return True
+
+    def redo(self):
+        """Reapply the latest undone step; returns False if there is none."""
+        if self.step is not None or not self.redo_steps:
+            return False
+        step = self.redo_steps.pop()
+        doc = self.document
+        with self.paused():
+            for op in step.ops:
+                kind, shape_id = op[0], op[1]
+                if kind == "create":
+                    doc.insert(clone(op[2]))
+                elif kind == "delete":
+                    doc.remove(shape_id)
+                elif kind == "move":
+                    doc.move(shape_id, op[2], op[3])
+                elif kind == "coords":
+                    doc.set_coords(shape_id, op[3])
+                elif kind == "style":
+                    doc.modify(shape_id, **op[3])
+                elif kind == "z":
+                    doc.set_z(shape_id, op[3])
+        self.undo_steps.append(step)
+        self.size += step.size
+        return True
@@ -0,0 +1,257 @@
+"""Tiled multi-resolution storage for imported rasters."""
+
+import hashlib
+import math
+import os
+import time
+from collections import Counter
+
+from PIL import Image
+
+TILE_SIZE = 256
+
+
+class ImagePyramid:
+    """Power-of-two mip levels of an image, handed out as square tiles.
+
+    Level 0 is the native resolution, level n is downscaled by 2**n.  Callers
+    ask for individual tiles so that only the visible part of a huge image is
+    ever turned into a Tk photo.  Levels are normally decoded off the Tk
+    thread (see loader.py) and installed once ready; until then a small
+    preview, if any, stands in for the image.  Only the levels needed for the
+    current zoom are decoded, using reduced-resolution decoding where the
+    format allows it; finer levels are fetched when the user zooms in.
+    Tiles are cut from whole decoded levels -- the decode itself is not per
+    tile -- so a level costs its full size in memory (3 bytes a pixel for
+    opaque images, 4 with alpha) once it is needed.
+    """
+
+    def __init__(self, path, key=None, tile_size=TILE_SIZE, size=None):
+        # size is given for an image whose file is missing: nothing is opened
+        # and the pyramid never becomes ready
+        self.path = path
+        self.key = key or path
+        self.tile_size = tile_size
+        self.missing = size is not None
+        if self.missing:
+            self.size = tuple(size)
+        else:
+            with Image.open(path) as img:
+                self.size = img.size
+        self.max_level = 0
+        while max(self.level_size(self.max_level)) > tile_size:
+            self.max_level += 1
+        self._levels = {}  # level -> decoded PIL image
+        self.preview = None
+        self.ready = False
+        self.content = None  # hash of the file, once known (see ImageRegistry)
+        self.used = 0.0  # when a tile was last cut, for ImageRegistry.trim
+
+    def install(self, levels):
+        """Add decoded levels, a {level: image} dict."""
+        self._levels.update(levels)
+        self.ready = True
+        self.used = time.monotonic()
+
+    def unload(self):
+        """Free every decoded level; the image is decoded again when next needed."""
+        self._levels.clear()
+        self.preview = None
+        self.ready = False
+
+    def level_bytes(self):
+        """{level: bytes} of the decoded levels."""
+        return {level: img.width * img.height * len(img.getbands()) for level, img in self._levels.items()}
+
+    def drop_level(self, level):
+        del self._levels[level]
+
+    def finest(self):
+        return min(self._levels) if self._levels else None
+
+    def best_level(self, wanted):
+        """Closest decoded level to wanted, preferring finer ones."""
+        finer = [level for level in self._levels if level <= wanted]
+        return max(finer) if finer else min(self._levels)
+
+    def level_size(self, level):
+        w, h = self.size
+        return (max(1, math.ceil(w / 2 ** level)), max(1, math.ceil(h / 2 ** level)))
+
+    def level_for(self, scale):
+        """Coarsest level that still has at least one pixel per screen pixel."""
+        if scale >= 1:
+            return 0
+        return min(self.max_level, int(math.floor(math.log2(1 / scale))))
+
+    def level(self, level):
+        """Decoded image for level, decoding it synchronously if needed (export)."""
+        img = self._levels.get(level)
+        if img is None:
+            if level - 1 in self._levels:
+                img = self._levels[level - 1].reduce(2)
+            else:
+                img = decode_levels(self.path, level, level)[level]
+            self._levels[level] = img
+        return img
+
+    def tile(self, level, tx, ty):
+        t = self.tile_size
+        self.used = time.monotonic()
+        img = self.level(level)
+        return img.crop((tx * t, ty * t, min((tx + 1) * t, img.width), min((ty + 1) * t, img.height)))
+
+    def tiles_in(self, level, rect):
+        """Tile indices at level covering rect, given in level-0 pixels."""
+        span = self.tile_size * 2 ** level
+        cols = math.ceil(self.size[0] / span)
+        rows = math.ceil(self.size[1] / span)
+        x1 = max(0, int(rect[0] // span))
+        y1 = max(0, int(rect[1] // span))
+        x2 = min(cols - 1, int(rect[2] // span))
+        y2 = min(rows - 1, int(rect[3] // span))
+        return [(tx, ty) for ty in range(y1, y2 + 1) for tx in range(x1, x2 + 1)]
+
+    def tile_rect(self, level, tx, ty):
+        """Area covered by a tile, in level-0 pixels."""
+        span = self.tile_size * 2 ** level
+        return (tx * span, ty * span, min((tx + 1) * span, self.size[0]), min((ty + 1) * span, self.size[1]))
+
+
+class ImageRegistry:
+    """Imported images, shared by content so each distinct bitmap is decoded once.
+
+    open() only stats the file: a new image is keyed provisionally by its
+    path, mtime and size, and its content hash is computed off the Tk thread
+    (see ImageLoader.identify) and handed to resolve().  An identical copy
+    under another name then becomes an alias of the pyramid already loaded,
+    so every key ever handed out keeps working with get().
+
+    Decoded pixels are bounded too: a pyramid no shape uses any more is
+    unloaded (acquire/release), and trim() drops the finest levels of the
+    least recently drawn images once the levels exceed budget bytes.
+    """
+
+    def __init__(self, budget=512 << 20):
+        self.budget = budget
+        self.clear()
+
+    def clear(self):
+        """Forget every image, e.g. when another document is opened."""
+        self.pyramids = {}  # key -> ImagePyramid, several keys may share one
+        self._keys = {}  # (path, mtime, size) -> key, to avoid rehashing
+        self._content = {}  # content hash -> ImagePyramid
+        self.users = Counter()  # key -> shapes showing it
+
+    def __contains__(self, key):
+        return key in self.pyramids
+
+    def open(self, path):
+        stat = os.stat(path)
+        signature = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        key = self._keys.get(signature)
+        if key is None:
+            key = self._keys[signature] = "%s:%d:%d" % signature
+            self.pyramids[key] = ImagePyramid(path, key)
+        return self.pyramids[key]
+
+    def missing(self, path, size):
+        """Stand-in for an image whose file cannot be read, keeping its path and size."""
+        key = "missing:%s" % os.path.abspath(path)
+        if key not in self.pyramids:
+            self.pyramids[key] = ImagePyramid(path, key, size=size)
+        return self.pyramids[key]
+
+    def resolve(self, key, content):
+        """Record the content hash of image key; returns the pyramid that now serves it."""
+        pyramid = self.pyramids[key]
+        pyramid.content = content
+        shared = self.pyramids[key] = self._content.setdefault(content, pyramid)
+        return shared
+
+    def get(self, key):
+        return self.pyramids[key]
+
+    def acquire(self, key):
+        self.users[key] += 1
+
+    def release(self, key):
+        """A shape showing image key went away; unload the image if it was the last."""
+        self.users[key] -= 1
+        if key in self.pyramids and not self.in_use(key):
+            self.pyramids[key].unload()
+
+    def in_use(self, key):
+        pyramid = self.pyramids[key]
+        return any(self.users[k] > 0 for k, p in self.pyramids.items() if p is pyramid)
+
+    def trim(self):
+        """Drop decoded levels over budget, finest levels of the least recently used images first.
+
+        The coarsest decoded level of each image is kept so it can still be drawn.
+        """
+        candidates, total = [], 0
+        for pyramid in {id(p): p for p in self.pyramids.values()}.values():
+            sizes = pyramid.level_bytes()
+            total += sum(sizes.values())
+            keep = max(sizes, default=None)
+            candidates.extend((pyramid.used, level, pyramid, size) for level, size in sizes.items() if level != keep)
+        candidates.sort(key=lambda c: c[:2])
+        for _, level, pyramid, size in candidates:
+            if total <= self.budget:
+                break
+            pyramid.drop_level(level)
+            total -= size
+
+
+def content_key(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def decoded_mode(img):
+    """RGBA only for images that can be transparent: opaque ones stay RGB, 3/4 the memory."""
+    if "A" in img.getbands() or "transparency" in img.info:
+        return "RGBA"
+    return "RGB"
+
+
+def make_preview(path, size=TILE_SIZE):
+    """Quick low resolution version of an image, at most size pixels across.
+
+    Returns None unless the format can decode at reduced size (JPEG drafts):
+    otherwise the preview would cost a full decode, as much as the levels.
+    """
+    with Image.open(path) as img:
+        full = img.size
+        img.draft("RGB", (size, size))
+        if img.size == full:
+            return None
+        img = img.convert(decoded_mode(img))
+    img.thumbnail((size, size))
+    return img
+
+
+def decode_levels(path, first, last):
+    """Decode pyramid levels first..last of an image as a {level: image} dict.
+
+    The file is decoded at the smallest resolution that still covers level
+    first: JPEG is asked for a DCT-scaled draft (1/2, 1/4 or 1/8 size) so the
+    full resolution is never materialized, other formats are reduced right
+    after decoding so only the needed level is kept.
+    """
+    with Image.open(path) as img:
+        w, h = img.size
+        target = (max(1, math.ceil(w / 2 ** first)), max(1, math.ceil(h / 2 ** first)))
+        if first:
+            img.draft("RGB", target)
+        base = img.convert(decoded_mode(img))
+    if base.size != target:
+        base = base.resize(target, Image.BOX)
+    levels = {first: base}
+    for level in range(first + 1, last + 1):
+        levels[level] = levels[level - 1].reduce(2)
+    return levels
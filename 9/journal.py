@@ -0,0 +1,244 @@
+"""Append-only journal of edits made since a project's last checkpoint.
+
+A save appends the edits made since the previous save to path + ".journal"
+instead of rewriting the whole project, so its cost follows the size of the
+edit: shapes that were added or reshaped are written whole, while moves,
+style changes and restacking are written as small operation records, so
+moving a huge stroke costs a few bytes.  Once the journal grows past a
+fraction of the checkpoint, or past JOURNAL_LIMIT so that opening a project
+stays quick, the caller compacts: it writes a full project file under a new
+checkpoint tag and starts an empty journal.
+
+Layout, all integers little-endian:
+
+    b"GYXJ"  u32 header length  header JSON  record  record ...
+
+where the header names the checkpoint the journal applies to and each
+record is u8 op, u32 length, payload.  PUT payloads are project.encode_shapes
+blocks (added or changed shapes); DELETE payloads are packed int32 ids; MOVE
+payloads are u32 count, int32 ids, float64 dx and float64 dy; RESTACK payloads
+are u32 count, int32 ids and int32 z; STYLE payloads are a JSON list of
+[id, {key: new value}, [removed keys]].  A record cut short by a crash is
+ignored on replay.
+"""
+
+import json
+import os
+import struct
+import uuid
+
+from document import muted, stacking
+from project import (apply_delta, decode_shapes, encode_shapes, pack_array, style_from_json, style_to_json,
+                     unpack_array)
+
+MAGIC = b"GYXJ"
+PUT = 1
+DELETE = 2
+MOVE = 3
+RESTACK = 4
+STYLE = 5
+COMPACT_RATIO = 0.5  # compact once the journal is this big relative to the checkpoint
+JOURNAL_LIMIT = 4 << 20  # ... or this big at all, since it is replayed whole on open
+
+
+def journal_path(path):
+    return path + ".journal"
+
+
+def new_checkpoint():
+    return uuid.uuid4().hex
+
+
+def read_journal(path, checkpoint):
+    """Replay the journal of project path: (shapes to put, ids deleted, deltas).
+
+    deltas are the moves, style changes and restacking of shapes stored in
+    the checkpoint, as {id: (dx, dy, style, unset keys, z)} for
+    ProjectFile.apply; edits of shapes in the journal are applied to them.
+
+    Returns nothing to apply if there is no journal or it was written
+    against another checkpoint (e.g. a crash interrupted a compaction).
+    """
+    try:
+        with open(journal_path(path), "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return [], set(), {}
+    if checkpoint is None or len(data) < 8 or data[:4] != MAGIC:
+        return [], set(), {}
+    header_len, = struct.unpack_from("<I", data, 4)
+    if json.loads(data[8:8 + header_len]).get("checkpoint") != checkpoint:
+        return [], set(), {}
+    puts, deleted, deltas = {}, set(), {}
+
+    def edit(shape_id, dx=0.0, dy=0.0, style=None, unset=(), z=None):
+        # Fold an operation into the pending delta of a stored shape, or
+        # straight into a shape put earlier in the journal
+        delta = (dx, dy, style or {}, set(unset), z)
+        if shape_id in puts:
+            apply_delta(puts[shape_id], delta)
+            return
+        old = deltas.get(shape_id)
+        if old is not None:
+            merged = {key: value for key, value in old[2].items() if key not in delta[3]}
+            merged.update(delta[2])
+            delta = (old[0] + dx, old[1] + dy, merged, (old[3] - set(delta[2])) | delta[3],
+                     z if z is not None else old[4])
+        deltas[shape_id] = delta
+
+    pos = 8 + header_len
+    while pos + 5 <= len(data):
+        op, length = struct.unpack_from("<BI", data, pos)
+        payload = memoryview(data)[pos + 5:pos + 5 + length]
+        if len(payload) < length:
+            break
+        if op == PUT:
+            for shape in decode_shapes(payload):
+                puts[shape.id] = shape
+                deleted.discard(shape.id)
+                deltas.pop(shape.id, None)
+        elif op == DELETE:
+            for shape_id in unpack_array("i", payload):
+                puts.pop(shape_id, None)
+                deltas.pop(shape_id, None)
+                deleted.add(shape_id)
+        elif op == MOVE:
+            count, = struct.unpack_from("<I", payload)
+            ids = unpack_array("i", payload[4:4 + 4 * count])
+            dxs = unpack_array("d", payload[4 + 4 * count:4 + 12 * count])
+            dys = unpack_array("d", payload[4 + 12 * count:4 + 20 * count])
+            for shape_id, dx, dy in zip(ids, dxs, dys):
+                edit(shape_id, dx=dx, dy=dy)
+        elif op == RESTACK:
+            count, = struct.unpack_from("<I", payload)
+            ids = unpack_array("i", payload[4:4 + 4 * count])
+            zs = unpack_array("i", payload[4 + 4 * count:4 + 8 * count])
+            for shape_id, z in zip(ids, zs):
+                edit(shape_id, z=z)
+        elif op == STYLE:
+            for shape_id, style, unset in json.loads(bytes(payload)):
+                edit(shape_id, style=style_from_json(style), unset=unset)
+        pos += 5 + length
+    return sorted(puts.values(), key=stacking), deleted, deltas
+
+
+class Journal:
+    """Tracks what changed since the last save of the current project.
+
+    Added and reshaped shapes are rewritten whole; moves, style changes and
+    restacking of other shapes are kept as operations.
+    """
+
+    def __init__(self, document):
+        self.document = document
+        self.path = None  # project file the journal belongs to
+        self.checkpoint = None
+        self.checkpoint_size = 0
+        self.size = 0
+        self.changed = set()  # ids to write whole
+        self.removed = set()
+        self.moved = {}  # id -> [dx, dy] since the last save
+        self.restyled = {}  # id -> style keys changed since the last save
+        self.restacked = set()
+        self._paused = False
+        document.listeners.append(self.on_change)
+
+    def on_change(self, event, shape, **info):
+        if self._paused:
+            return
+        if event == "remove":
+            self.forget(shape.id)
+            self.removed.add(shape.id)
+            return
+        self.removed.discard(shape.id)
+        if shape.id in self.changed:
+            return  # written whole anyway
+        if event == "raise":
+            self.restacked.add(shape.id)
+        elif "offset" in info:
+            moved = self.moved.setdefault(shape.id, [0.0, 0.0])
+            moved[0] += info["offset"][0]
+            moved[1] += info["offset"][1]
+        elif "old_style" in info:
+            self.restyled.setdefault(shape.id, set()).update(info["old_style"])
+        else:
+            # Added, reshaped or extended
+            self.forget(shape.id)
+            self.changed.add(shape.id)
+
+    def forget(self, shape_id):
+        self.changed.discard(shape_id)
+        self.moved.pop(shape_id, None)
+        self.restyled.pop(shape_id, None)
+        self.restacked.discard(shape_id)
+
+    def clear(self):
+        self.changed.clear()
+        self.removed.clear()
+        self.moved.clear()
+        self.restyled.clear()
+        self.restacked.clear()
+
+    def paused(self):
+        """Context in which edits are not journaled, e.g. shapes paged in from the file."""
+        return muted(self)
+
+    def attach(self, path, checkpoint):
+        """Continue the existing journal of a project that was just opened."""
+        self.path, self.checkpoint = path, checkpoint
+        self.checkpoint_size = os.path.getsize(path)
+        try:
+            self.size = os.path.getsize(journal_path(path))
+        except OSError:
+            self.size = 0
+        self.clear()
+
+    def start(self, path, checkpoint):
+        """Begin an empty journal after writing a full checkpoint to path."""
+        header = json.dumps({"checkpoint": checkpoint}).encode("utf-8")
+        with open(journal_path(path), "wb") as f:
+            f.write(MAGIC + struct.pack("<I", len(header)) + header)
+        self.attach(path, checkpoint)
+
+    def detach(self):
+        self.path = self.checkpoint = None
+        self.clear()
+
+    def can_append(self, path):
+        return (self.checkpoint is not None and self.path == path
+                and self.size <= min(COMPACT_RATIO * max(self.checkpoint_size, 1 << 20), JOURNAL_LIMIT))
+
+    def append(self):
+        """Write the edits since the last save; returns the number of bytes added."""
+        records = []
+        if self.removed:
+            records.append((DELETE, pack_array("i", sorted(self.removed))))
+        shapes = [self.document.get(i) for i in sorted(self.changed)]
+        if shapes:
+            records.append((PUT, encode_shapes(shapes)))
+        if self.moved:
+            ids = sorted(self.moved)
+            records.append((MOVE, struct.pack("<I", len(ids)) + pack_array("i", ids)
+                            + pack_array("d", [self.moved[i][0] for i in ids])
+                            + pack_array("d", [self.moved[i][1] for i in ids])))
+        if self.restyled:
+            edits = []
+            for shape_id in sorted(self.restyled):
+                style = self.document.get(shape_id).style
+                keys = self.restyled[shape_id]
+                edits.append([shape_id, style_to_json({key: style[key] for key in keys if key in style}),
+                              sorted(key for key in keys if key not in style)])
+            records.append((STYLE, json.dumps(edits, separators=(",", ":")).encode("utf-8")))
+        if self.restacked:
+            ids = sorted(self.restacked)
+            records.append((RESTACK, struct.pack("<I", len(ids)) + pack_array("i", ids)
+                            + pack_array("i", [self.document.get(i).z for i in ids])))
+        data = b"".join(struct.pack("<BI", op, len(payload)) + payload for op, payload in records)
+        if data:
+            with open(journal_path(self.path), "ab") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+        self.size += len(data)
+        self.clear()
+        return len(data)
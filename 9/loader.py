@@ -0,0 +1,79 @@
+"""Background image decoding for the editor."""
+
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+from imagery import content_key, decode_levels, make_preview
+
+
+class ImageLoader:
+    """Decode images on a thread pool and deliver the results on the Tk thread.
+
+    PIL releases the GIL while decoding and resampling, so a thread pool keeps
+    every core busy when several files are imported at once without having to
+    pickle pixel buffers between processes.  callback(key, kind, payload) is
+    called from the Tk main loop, with the pyramid's key and kind "hashed",
+    "preview", "levels" or "error".
+    """
+
+    def __init__(self, widget, callback, workers=None, poll_ms=30):
+        self.widget = widget
+        self.callback = callback
+        self.poll_ms = poll_ms
+        self.executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count())
+        self.results = queue.Queue()
+        self.active = set()  # keys of pyramids being decoded
+        self.pending = 0
+
+    def identify(self, pyramid):
+        """Hash the file of pyramid, for ImageRegistry.resolve()."""
+        if pyramid.key in self.active:
+            return
+        self.active.add(pyramid.key)
+        self.pending += 1
+        self.executor.submit(self._hash, pyramid.key, pyramid.path)
+        if self.pending == 1:
+            self.widget.after(self.poll_ms, self._poll)
+
+    def _hash(self, key, path):
+        try:
+            self.results.put((key, "hashed", content_key(path)))
+        except Exception as exc:
+            self.results.put((key, "error", exc))
+
+    def load(self, pyramid, first, last=None):
+        """Decode levels first..last (default: down to the coarsest) of pyramid."""
+        if pyramid.key in self.active:
+            return
+        if last is None:
+            last = pyramid.max_level
+        self.active.add(pyramid.key)
+        self.pending += 1
+        self.executor.submit(self._decode, pyramid.key, pyramid.path, first, last, not pyramid.ready)
+        if self.pending == 1:
+            self.widget.after(self.poll_ms, self._poll)
+
+    def _decode(self, key, path, first, last, preview):
+        # Runs on a worker thread: touch nothing but PIL and the queue here
+        try:
+            if preview:
+                img = make_preview(path)
+                if img is not None:
+                    self.results.put((key, "preview", img))
+            self.results.put((key, "levels", decode_levels(path, first, last)))
+        except Exception as exc:
+            self.results.put((key, "error", exc))
+
+    def _poll(self):
+        while True:
+            try:
+                key, kind, payload = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if kind != "preview":
+                self.pending -= 1
+                self.active.discard(key)
+            self.callback(key, kind, payload)
+        if self.pending:
+            self.widget.after(self.poll_ms, self._poll)
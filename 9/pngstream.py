@@ -0,0 +1,62 @@
+"""Write a PNG from independently compressed strips of rows.
+
+Each strip is deflated on its own (possibly in another process) and ends on a
+byte boundary with a sync flush, so the strips can simply be concatenated into
+one zlib stream; only their Adler-32 checksums have to be combined.  This is
+how the file is produced without ever holding the whole image in memory.
+"""
+
+import struct
+import zlib
+
+SIGNATURE = b"\x89PNG\r\n\x1a\n"
+ZLIB_HEADER = b"\x78\x9c"
+_ADLER_BASE = 65521
+
+
+def compress_rows(img, last, level=6):
+    """Deflate an RGB strip as PNG scanlines (filter type 0).
+
+    Returns (data, adler32 of the raw scanlines, length of the raw scanlines).
+    """
+    stride = img.width * 3
+    pixels = img.tobytes()
+    raw = b"".join(b"\x00" + pixels[i:i + stride] for i in range(0, len(pixels), stride))
+    deflate = zlib.compressobj(level, zlib.DEFLATED, -15)
+    data = deflate.compress(raw) + deflate.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+    return data, zlib.adler32(raw), len(raw)
+
+
+def adler32_combine(adler1, adler2, len2):
+    """Checksum of A + B given the checksums of A and B (zlib's adler32_combine)."""
+    rem = len2 % _ADLER_BASE
+    sum1 = adler1 & 0xFFFF
+    sum2 = (rem * sum1) % _ADLER_BASE
+    sum1 = (sum1 + (adler2 & 0xFFFF) + _ADLER_BASE - 1) % _ADLER_BASE
+    sum2 = (sum2 + (adler1 >> 16) + (adler2 >> 16) + _ADLER_BASE - rem) % _ADLER_BASE
+    return sum1 | (sum2 << 16)
+
+
+class PNGStreamWriter:
+    """8-bit RGB PNG fed strip by strip, top to bottom, from compress_rows()."""
+
+    def __init__(self, f, width, height):
+        self.f = f
+        self.adler = 1
+        f.write(SIGNATURE)
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        self._chunk(b"IDAT", ZLIB_HEADER)
+
+    def write(self, data, adler, length):
+        self.adler = adler32_combine(self.adler, adler, length)
+        if data:
+            self._chunk(b"IDAT", data)
+
+    def close(self):
+        """Finish the file; the last strip must have been compressed with last=True."""
+        self._chunk(b"IDAT", struct.pack(">I", self.adler))
+        self._chunk(b"IEND", b"")
+
+    def _chunk(self, kind, data):
+        self.f.write(struct.pack(">I", len(data)) + kind + data)
+        self.f.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
@@ -0,0 +1,266 @@
+"""Native GraphyX project files (.gyx).
+
+Layout, all integers little-endian:
+
+    b"GYX1"  u32 header length  header JSON  shape block  shape block ...
+
+The header holds the format version, the drawing's bounds, the view it was
+saved with, the highest shape id and z in use and an index of the shape blocks (chunks): their byte range and
+the bounds of the shapes they hold.  Each chunk stores per-shape columns as
+packed arrays -- ids and z as int32, point counts as uint32 and every
+coordinate of its shapes in one float32 array -- plus a JSON list of kinds
+and styles.  Points therefore cost 4 bytes each and are read and written with
+a single array copy instead of one object per point.  Shapes are grouped into
+chunks by position, so opening a file only has to decode the chunks around
+the saved view (see ProjectFile).  Images are stored by reference (their
+path), not by content.  Version 1 files hold a single chunk and no index.
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from document import Shape
+from spatial import intersects, union
+
+MAGIC = b"GYX1"
+VERSION = 2
+EXTENSION = ".gyx"
+CHUNK_SHAPES = 256  # shapes per chunk
+
+
+def pack_array(typecode, values):
+    packed = array(typecode, values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def unpack_array(typecode, buffer):
+    values = array(typecode)
+    values.frombytes(buffer)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def style_to_json(style):
+    # Tuples (font, size) become lists in JSON; everything else is plain data
+    return {key: list(value) if isinstance(value, tuple) else value for key, value in style.items()}
+
+
+def style_from_json(style):
+    return {key: tuple(value) if isinstance(value, list) else value for key, value in style.items()}
+
+
+def encode_shapes(shapes):
+    """Serialize shapes (keeping ids and z) into a self-contained block."""
+    coords = array("f")
+    for shape in shapes:
+        coords.extend(shape.coords)
+    if sys.byteorder == "big":
+        coords.byteswap()
+    meta = json.dumps({
+        "kinds": [shape.kind for shape in shapes],
+        "styles": [style_to_json(shape.style) for shape in shapes],
+    }, separators=(",", ":")).encode("utf-8")
+    return b"".join([
+        struct.pack("<II", len(shapes), len(meta)), meta,
+        pack_array("i", [shape.id for shape in shapes]),
+        pack_array("i", [shape.z for shape in shapes]),
+        pack_array("I", [len(shape.coords) for shape in shapes]),
+        coords.tobytes(),
+    ])
+
+
+def decode_shapes(buffer):
+    """Inverse of encode_shapes; buffer may be bytes, a memoryview or an mmap slice."""
+    view = memoryview(buffer)
+    count, meta_len = struct.unpack_from("<II", view)
+    pos = 8
+    meta = json.loads(bytes(view[pos:pos + meta_len]))
+    pos += meta_len
+    ids = unpack_array("i", view[pos:pos + 4 * count])
+    zs = unpack_array("i", view[pos + 4 * count:pos + 8 * count])
+    counts = unpack_array("I", view[pos + 8 * count:pos + 12 * count])
+    pos += 12 * count
+    coords = unpack_array("f", view[pos:pos + 4 * sum(counts)]).tolist()
+    shapes = []
+    start = 0
+    for i, (kind, style) in enumerate(zip(meta["kinds"], meta["styles"])):
+        shape = Shape(kind, (), **style_from_json(style))
+        shape.coords = coords[start:start + counts[i]]
+        shape.id = ids[i]
+        shape.z = zs[i]
+        start += counts[i]
+        shapes.append(shape)
+    return shapes
+
+
+def apply_delta(shape, delta):
+    """Apply a journaled edit (dx, dy, style, unset keys, z or None) to a decoded shape."""
+    dx, dy, style, unset, z = delta
+    if dx or dy:
+        coords = list(shape.coords)
+        coords[0::2] = [x + dx for x in coords[0::2]]
+        coords[1::2] = [y + dy for y in coords[1::2]]
+        shape.coords = coords
+    if style or unset:
+        shape.style = {key: value for key, value in dict(shape.style, **style).items() if key not in unset}
+    if z is not None:
+        shape.z = z
+
+
+# Bits of a byte spread out to every other bit, for Z-order keys
+_SPREAD = [sum(((b >> i) & 1) << (2 * i) for i in range(8)) for b in range(256)]
+
+
+def _morton(x, y):
+    # Interleave the bits of two 16-bit integers (Z-order curve)
+    return (_SPREAD[x & 255] | _SPREAD[x >> 8] << 16) | (_SPREAD[y & 255] | _SPREAD[y >> 8] << 16) << 1
+
+
+def spatial_chunks(shapes, size=CHUNK_SHAPES):
+    """Split shapes into groups of nearby shapes, following a Z-order curve."""
+    if not shapes:
+        return []
+    boxes = [shape.bounds() for shape in shapes]
+    x1, y1, x2, y2 = boxes[0]
+    for box in boxes:
+        x1, y1, x2, y2 = union((x1, y1, x2, y2), box)
+    sx, sy = 65535 / max(x2 - x1, 1e-9), 65535 / max(y2 - y1, 1e-9)
+    order = sorted(range(len(shapes)), key=lambda i: _morton(
+        int(((boxes[i][0] + boxes[i][2]) / 2 - x1) * sx), int(((boxes[i][1] + boxes[i][3]) / 2 - y1) * sy)))
+    return [[shapes[i] for i in order[start:start + size]] for start in range(0, len(order), size)]
+
+
+def save_project(document, path, view=None, checkpoint=None):
+    """Write document to path; view is an optional {"scale", "center"} to reopen at.
+
+    checkpoint tags the file so that only the journal written against it is
+    replayed (see journal.py).  The file is replaced atomically.
+    """
+    save_shapes(list(document), path, view, checkpoint)
+
+
+def save_shapes(shapes, path, view=None, checkpoint=None):
+    """save_project for a plain list of shapes, e.g. a snapshot being autosaved."""
+    chunks, blocks, offset, total = [], [], 0, None
+    for group in spatial_chunks(shapes):
+        bounds = group[0].bounds()
+        for shape in group:
+            bounds = union(bounds, shape.bounds())
+        total = union(total, bounds)
+        blocks.append(encode_shapes(group))
+        chunks.append({"bounds": bounds, "offset": offset, "length": len(blocks[-1])})
+        offset += len(blocks[-1])
+    header = json.dumps({"version": VERSION, "shapes": len(shapes), "bounds": total,
+                         "max_id": max((shape.id for shape in shapes), default=0),
+                         "max_z": max((shape.z for shape in shapes), default=0),
+                         "view": view, "checkpoint": checkpoint, "chunks": chunks}).encode("utf-8")
+    with open(path + ".tmp", "wb") as f:
+        f.write(MAGIC + struct.pack("<I", len(header)) + header)
+        for block in blocks:
+            f.write(block)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+class ProjectFile:
+    """A memory-mapped project whose chunks are decoded on demand.
+
+    Opening only parses the header, so it takes the same time whatever the
+    file size; read(rect) then decodes the chunks overlapping rect that have
+    not been read yet.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:4] != MAGIC:
+            self.map.close()
+            raise ValueError("%s is not a GraphyX project" % path)
+        header_len, = struct.unpack_from("<I", self.map, 4)
+        header = json.loads(self.map[8:8 + header_len])
+        if header["version"] > VERSION:
+            self.map.close()
+            raise ValueError("%s needs a newer GraphyX (format %d)" % (path, header["version"]))
+        self.data_start = 8 + header_len
+        self.bounds = header.get("bounds")
+        self.view = header.get("view")
+        self.checkpoint = header.get("checkpoint")
+        # So that shapes added before every chunk is read do not reuse ids or z
+        self.max_id = header.get("max_id", 0)
+        self.max_z = header.get("max_z", 0)
+        self.overlay = []  # shapes to hand out on the next read, whatever the rect
+        self.skip = set()  # ids superseded or deleted after the checkpoint
+        self.deltas = {}  # id -> edit to apply when its chunk is read, see apply_delta
+        if "chunks" in header:
+            self.pending = header["chunks"]  # empty for an empty drawing
+        else:
+            # Version 1: one chunk without bounds, always read
+            self.pending = [{"bounds": None, "offset": 0, "length": len(self.map) - self.data_start}]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def done(self):
+        return not self.pending and not self.overlay
+
+    def apply(self, shapes, deleted, deltas=None):
+        """Layer later edits (e.g. a replayed journal) over the stored chunks.
+
+        shapes replace or add whole shapes, deleted ids are dropped and
+        deltas ({id: edit}) are applied to stored shapes as they are read.
+        """
+        self.overlay = shapes
+        self.skip = {shape.id for shape in shapes} | set(deleted)
+        self.deltas = deltas or {}
+        self.max_id = max([self.max_id] + [shape.id for shape in shapes])
+        self.max_z = max([self.max_z] + [shape.z for shape in shapes]
+                         + [delta[4] for delta in self.deltas.values() if delta[4] is not None])
+        # Moved shapes may have left their chunk's bounds: widen every bound
+        # by the range of the offsets so rect queries still find them
+        moves = [(delta[0], delta[1]) for delta in self.deltas.values() if delta[0] or delta[1]]
+        if moves:
+            lo_x, lo_y = min(0, min(m[0] for m in moves)), min(0, min(m[1] for m in moves))
+            hi_x, hi_y = max(0, max(m[0] for m in moves)), max(0, max(m[1] for m in moves))
+            widen = lambda b: b and [b[0] + lo_x, b[1] + lo_y, b[2] + hi_x, b[3] + hi_y]
+            self.pending = [dict(chunk, bounds=widen(chunk["bounds"])) for chunk in self.pending]
+            self.bounds = widen(self.bounds)
+
+    def read(self, rect=None):
+        """Decode the unread chunks overlapping rect (all of them if rect is None)."""
+        shapes, keep = self.overlay, []
+        self.overlay = []
+        for chunk in self.pending:
+            if rect is None or chunk["bounds"] is None or intersects(chunk["bounds"], rect):
+                start = self.data_start + chunk["offset"]
+                for shape in decode_shapes(self.map[start:start + chunk["length"]]):
+                    if shape.id in self.skip:
+                        continue
+                    if shape.id in self.deltas:
+                        apply_delta(shape, self.deltas[shape.id])
+                    shapes.append(shape)
+            else:
+                keep.append(chunk)
+        self.pending = keep
+        return shapes
+
+    def close(self):
+        self.map.close()
+
+
+def load_project(path):
+    """Every shape stored in a project file."""
+    with ProjectFile(path) as project:
+        return project.read()
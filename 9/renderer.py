@@ -0,0 +1,328 @@
+"""Mirror a Document onto a Tk canvas.
+
+Only shapes near the viewport are materialized as canvas items; the rest of
+the document lives purely in the model and spatial index until panning or
+zooming brings it into view.  When zoomed out, detail is reduced: sub-pixel
+shapes are skipped, strokes are decimated to screen resolution and tiny text
+becomes a placeholder box.  Imported images are drawn as tiles from a
+mip-map pyramid, only for the part of them near the viewport.
+"""
+
+import bisect
+import math
+from collections import OrderedDict
+
+from PIL import ImageTk
+
+from imagery import ImageRegistry
+from simplify import simplify_stroke
+from spatial import contains, intersects
+from view import ViewTransform
+
+
+class PhotoCache:
+    """Size-bounded LRU of PhotoImages for image tiles.
+
+    Tiles on screen are also referenced by the renderer, so evicting one
+    only frees it once it scrolls away; panning back or showing the same
+    image twice reuses the cached photo instead of converting pixels again.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget  # bytes of RGBA pixel data
+        self.used = 0
+        self._photos = OrderedDict()  # key -> (PhotoImage, bytes)
+
+    def __len__(self):
+        return len(self._photos)
+
+    def get(self, key):
+        entry = self._photos.get(key)
+        if entry is None:
+            return None
+        self._photos.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, photo, nbytes):
+        self._photos[key] = (photo, nbytes)
+        self.used += nbytes
+        while self.used > self.budget and len(self._photos) > 1:
+            _, (_, freed) = self._photos.popitem(last=False)
+            self.used -= freed
+
+
+class CanvasRenderer:
+    def __init__(self, canvas, document, images=None, margin=0.5, photo_budget=64 << 20):
+        self.canvas = canvas
+        self.document = document
+        self.images = images if images is not None else ImageRegistry()
+        self.photo_cache = PhotoCache(photo_budget)
+        self.margin = margin  # extra fraction of the viewport kept materialized
+        self.items = {}  # shape id -> canvas item id, for materialized shapes only
+        self.tiles = {}  # image shape id -> {(level, tx, ty): (item, PhotoImage)}
+        self.on_missing_level = None  # callback(pyramid, level) to decode finer levels
+        self.on_region = None  # callback(rect) to page shapes into the document before rect is drawn
+        self.forms = {}  # shape id -> "full" or "box", how the shape is drawn
+        self.min_pixels = 1.0  # shapes smaller than this on screen are skipped
+        self.text_pixels = 4  # text smaller than this is drawn as a box
+        self._stack = []  # sorted (z, id) of drawn shapes, mirrors canvas stacking
+        self._region = None  # world rect whose shapes are materialized
+        self.view = ViewTransform()
+        document.listeners.append(self.on_change)
+        canvas.bind("<Configure>", lambda event: self.refresh(force=True), add="+")
+
+    def on_change(self, event, shape, **info):
+        drawn = shape.id in self.items
+        if event == "remove":
+            if drawn:
+                self.hide(shape)
+        elif event == "raise":
+            if drawn:
+                self._stack.remove(info["old_key"])
+                bisect.insort(self._stack, (shape.z, shape.id))
+                if self._stack[-1] == (shape.z, shape.id):
+                    self.canvas.tag_raise(self.items[shape.id])
+                else:
+                    self.restack(shape)
+        elif not self.wanted(shape.id):
+            if drawn:
+                self.hide(shape)
+        elif not drawn:
+            self.show(shape)
+        elif event == "extend":
+            self.canvas.insert(self.items[shape.id], "end", self.view.to_canvas(info["points"]))
+        elif event == "update":
+            if "old_style" in info or shape.kind == "image" or self.forms[shape.id] == "box":
+                self.reproject(shape)
+            else:
+                self.canvas.coords(self.items[shape.id], *self.project(shape))
+
+    def wanted(self, shape_id):
+        return self.worth_drawing(self.document.index.bounds_of(shape_id))
+
+    def worth_drawing(self, bounds):
+        if self._region is not None and not intersects(self._region, bounds):
+            return False
+        # Level of detail: skip shapes that would cover less than a pixel
+        return self.view.length(max(bounds[2] - bounds[0], bounds[3] - bounds[1])) >= self.min_pixels
+
+    def form(self, shape):
+        if shape.kind == "text" and self.view.length(shape.style.get("font", ("Arial", 16, ""))[1]) < self.text_pixels:
+            return "box"
+        return "full"
+
+    def project(self, shape):
+        coords = self.view.to_canvas(shape.coords)
+        if shape.kind == "pencil" and self.view.scale < 1:
+            # Zoomed out: no point sending Tk several vertices per pixel
+            coords = simplify_stroke(coords, self.min_pixels / 2)
+        return coords
+
+    def show(self, shape):
+        self.items[shape.id] = self.draw(shape)
+        bisect.insort(self._stack, (shape.z, shape.id))
+        self.restack(shape)
+
+    def restack(self, shape):
+        pos = bisect.bisect(self._stack, (shape.z, shape.id))
+        if pos < len(self._stack):
+            # Not the topmost shape: slide under the shape that follows it
+            self.canvas.tag_lower(self.items[shape.id], self.items[self._stack[pos][1]])
+
+    def hide(self, shape):
+        self.canvas.delete(self.items.pop(shape.id))
+        self.tiles.pop(shape.id, None)
+        self.forms.pop(shape.id, None)
+        key = (shape.z, shape.id)
+        del self._stack[bisect.bisect_left(self._stack, key)]
+
+    def reproject(self, shape):
+        """Bring a drawn shape up to date with the current view."""
+        form = self.form(shape)
+        if shape.kind == "image" or form != self.forms[shape.id]:
+            # Bitmaps have to be resampled and a change of detail level needs
+            # a different item type; swap the item in place in the stack
+            self.hide(shape)
+            self.show(shape)
+            return
+        item = self.items[shape.id]
+        if form == "box":
+            self.canvas.coords(item, *self.view.to_canvas(shape.bounds()))
+        else:
+            self.canvas.coords(item, *self.project(shape))
+            self.canvas.itemconfig(item, **self.options(shape))
+
+    def viewport(self):
+        """The visible part of the canvas, in world coordinates."""
+        c = self.canvas
+        x1, y1 = self.view.to_world(c.canvasx(0), c.canvasy(0))
+        x2, y2 = self.view.to_world(c.canvasx(c.winfo_width()), c.canvasy(c.winfo_height()))
+        return (x1, y1, x2, y2)
+
+    def zoom(self, scale):
+        """Change the view scale, keeping the centre of the view in place."""
+        if scale == self.view.scale:
+            return
+        c = self.canvas
+        cx, cy = c.canvasx(c.winfo_width() / 2), c.canvasy(c.winfo_height() / 2)
+        ratio = scale / self.view.scale
+        self.view.scale = scale
+        c.scan_mark(0, 0)
+        c.scan_dragto(int(round(cx - cx * ratio)), int(round(cy - cy * ratio)), gain=1)
+        self.refresh(force=True, reproject=True)
+
+    def center_on(self, x, y):
+        """Scroll so that world point (x, y) is in the middle of the view."""
+        c = self.canvas
+        cx, cy = c.canvasx(c.winfo_width() / 2), c.canvasy(c.winfo_height() / 2)
+        tx, ty = self.view.to_canvas((x, y))
+        c.scan_mark(0, 0)
+        c.scan_dragto(int(round(cx - tx)), int(round(cy - ty)), gain=1)
+        self.refresh()
+
+    def refresh(self, force=False, reproject=False):
+        """Materialize shapes around the viewport and drop the ones far from it.
+
+        Cheap while the viewport stays inside the materialized region, so it
+        can be called on every pan frame.
+        """
+        x1, y1, x2, y2 = self.viewport()
+        if not force and self._region is not None and contains(self._region, (x1, y1, x2, y2)):
+            return
+        mx, my = (x2 - x1) * self.margin, (y2 - y1) * self.margin
+        self._region = (x1 - mx, y1 - my, x2 + mx, y2 + my)
+        if self.on_region:
+            self.on_region(self._region)
+        index = self.document.index
+        wanted = {i for i in index.query(self._region) if self.worth_drawing(index.bounds_of(i))}
+        for shape_id in list(self.items):
+            shape = self.document.get(shape_id)
+            if shape_id not in wanted:
+                self.hide(shape)
+            elif reproject:
+                self.reproject(shape)
+            elif shape.kind == "image" and self.update_tiles(shape):
+                self.restack(shape)
+        for shape in sorted((self.document.get(i) for i in wanted if i not in self.items),
+                            key=lambda shape: (shape.z, shape.id)):
+            self.show(shape)
+
+    def options(self, shape):
+        style = shape.style
+        color = style.get("color", "black")
+        width = self.view.length(style.get("width", 1))
+        if shape.kind in ("line", "pencil"):
+            return {"fill": color, "width": width, "smooth": shape.kind == "pencil"}
+        if shape.kind in ("rectangle", "oval"):
+            return {"outline": color, "fill": style.get("fill", ""), "width": width}
+        if shape.kind == "text":
+            family, size, weight = style.get("font", ("Arial", 16, ""))
+            font = (family, max(1, int(round(self.view.length(size)))), weight)
+            return {"text": style.get("text", ""), "fill": color, "font": font}
+        return {}
+
+    def draw(self, shape):
+        form = self.forms[shape.id] = self.form(shape)
+        if form == "box":
+            return self.canvas.create_rectangle(*self.view.to_canvas(shape.bounds()), outline="", fill="lightgray")
+        options = self.options(shape)
+        coords = self.project(shape)
+        if shape.kind in ("line", "pencil"):
+            return self.canvas.create_line(*coords, **options)
+        if shape.kind == "rectangle":
+            return self.canvas.create_rectangle(*coords, **options)
+        if shape.kind == "oval":
+            return self.canvas.create_oval(*coords, **options)
+        if shape.kind == "text":
+            return self.canvas.create_text(*coords, **options)
+        if shape.kind == "image":
+            # All tiles of the image share a tag, which stands in for the item
+            self.tiles[shape.id] = {}
+            self.update_tiles(shape)
+            return "shape%d" % shape.id
+        raise ValueError("unknown shape kind: %r" % shape.kind)
+
+    def update_tiles(self, shape):
+        """Create the tiles of an image near the viewport and drop the rest.
+
+        Returns True if any tile was created (it then sits on top of the stack).
+        """
+        pyramid = self.images.get(shape.style["asset"])
+        if not pyramid.ready:
+            return self.update_placeholder(shape, pyramid)
+        wanted = pyramid.level_for(self.view.scale)
+        level = pyramid.best_level(wanted)
+        if level > wanted and self.on_missing_level:
+            # Show the coarser level for now and ask for the sharper one
+            self.on_missing_level(pyramid, wanted)
+        x, y = shape.coords
+        rx1, ry1, rx2, ry2 = self._region or shape.bounds()
+        needed = {(level, tx, ty) for tx, ty in pyramid.tiles_in(level, (rx1 - x, ry1 - y, rx2 - x, ry2 - y))}
+        tiles = self.tiles[shape.id]
+        for key in list(tiles):
+            if key not in needed:
+                self.canvas.delete(tiles.pop(key)[0])
+        created = False
+        for key in sorted(needed.difference(tiles)):
+            tx1, ty1, tx2, ty2 = pyramid.tile_rect(*key)
+            cx1, cy1, cx2, cy2 = [round(c) for c in self.view.to_canvas((x + tx1, y + ty1, x + tx2, y + ty2))]
+            # Snap tile edges to whole pixels so neighbouring tiles do not leave seams
+            size = (max(1, cx2 - cx1), max(1, cy2 - cy1))
+            photo = self.photo_cache.get((pyramid.key, key, size))
+            if photo is None:
+                photo = ImageTk.PhotoImage(pyramid.tile(*key).resize(size))
+                self.photo_cache.put((pyramid.key, key, size), photo, size[0] * size[1] * 4)
+            item = self.canvas.create_image(cx1, cy1, anchor="nw", image=photo, tags=("shape%d" % shape.id,))
+            tiles[key] = (item, photo)
+            created = True
+        return created
+
+    def update_placeholder(self, shape, pyramid):
+        """Stand in for an image whose levels are still being decoded.
+
+        Shows the stretched preview if it has arrived, a grey box otherwise,
+        limited to the part of the image inside the materialized region.
+        """
+        tiles = self.tiles[shape.id]
+        for item, photo in tiles.values():
+            self.canvas.delete(item)
+        tiles.clear()
+        x, y = shape.coords
+        w, h = pyramid.size
+        rx1, ry1, rx2, ry2 = self._region or shape.bounds()
+        vx1, vy1, vx2, vy2 = max(x, rx1), max(y, ry1), min(x + w, rx2), min(y + h, ry2)
+        if vx1 >= vx2 or vy1 >= vy2:
+            return False
+        cx1, cy1, cx2, cy2 = [round(c) for c in self.view.to_canvas((vx1, vy1, vx2, vy2))]
+        tag = "shape%d" % shape.id
+        photo = None
+        if pyramid.preview is None:
+            # Outlined in red if the file is missing rather than still loading
+            item = self.canvas.create_rectangle(cx1, cy1, cx2, cy2, fill="lightgray",
+                                                outline="red" if pyramid.missing else "", tags=(tag,))
+        else:
+            sx, sy = pyramid.preview.width / w, pyramid.preview.height / h
+            box = (int((vx1 - x) * sx), int((vy1 - y) * sy),
+                   max(int((vx1 - x) * sx) + 1, math.ceil((vx2 - x) * sx)),
+                   max(int((vy1 - y) * sy) + 1, math.ceil((vy2 - y) * sy)))
+            img = pyramid.preview.crop(box).resize((max(1, cx2 - cx1), max(1, cy2 - cy1)))
+            photo = ImageTk.PhotoImage(img)
+            item = self.canvas.create_image(cx1, cy1, anchor="nw", image=photo, tags=(tag,))
+        tiles["placeholder"] = (item, photo)
+        return True
+
+    def image_changed(self, key):
+        """Redraw shapes showing image key, e.g. once its decoded levels arrive."""
+        pyramid = self.images.get(key)
+        for shape_id in list(self.tiles):
+            shape = self.document.get(shape_id)
+            if self.images.get(shape.style["asset"]) is pyramid:
+                self.reproject(shape)
+
+    def redraw(self):
+        for item in self.items.values():
+            self.canvas.delete(item)
+        self.items.clear()
+        self.tiles.clear()
+        self._stack = []
+        self.refresh(force=True)
@@ -0,0 +1,31 @@
+"""Frame-paced coalescing of pointer motion events."""
+
+
+class MotionCoalescer:
+    """Queue motion events and hand them to handler at most once per frame.
+
+    handler receives the list of events that arrived since the previous
+    frame, oldest first, so tools that need every sample (the pencil) can
+    still have them while the rest only look at the latest one.
+    """
+
+    def __init__(self, widget, handler, frame_ms=16):
+        self.widget = widget
+        self.handler = handler
+        self.frame_ms = frame_ms
+        self.pending = []
+        self._after_id = None
+
+    def push(self, event):
+        self.pending.append(event)
+        if self._after_id is None:
+            self._after_id = self.widget.after(self.frame_ms, self.flush)
+
+    def flush(self):
+        """Apply queued events now, e.g. before the button is released."""
+        if self._after_id is not None:
+            self.widget.after_cancel(self._after_id)
+            self._after_id = None
+        events, self.pending = self.pending, []
+        if events:
+            self.handler(events)
@@ -0,0 +1,59 @@
+"""Polyline simplification for committed pencil strokes."""
+
+
+def drop_jitter(coords, min_dist):
+    """Remove duplicate samples and points closer than min_dist to the last kept one."""
+    if len(coords) <= 4:
+        return list(coords)
+    kept = [coords[0], coords[1]]
+    limit = min_dist * min_dist
+    for i in range(2, len(coords) - 2, 2):
+        dx = coords[i] - kept[-2]
+        dy = coords[i + 1] - kept[-1]
+        if dx * dx + dy * dy >= limit:
+            kept += [coords[i], coords[i + 1]]
+    # Always keep the real end point of the stroke
+    kept += [coords[-2], coords[-1]]
+    return kept
+
+
+def rdp(coords, tolerance):
+    """Ramer-Douglas-Peucker on a flat [x0, y0, x1, y1, ...] list."""
+    n = len(coords) // 2
+    if n <= 2:
+        return list(coords)
+    keep = [False] * n
+    keep[0] = keep[n - 1] = True
+    limit = tolerance * tolerance
+    stack = [(0, n - 1)]
+    # Iterative so that very long strokes do not hit the recursion limit
+    while stack:
+        first, last = stack.pop()
+        ax, ay = coords[2 * first], coords[2 * first + 1]
+        bx, by = coords[2 * last], coords[2 * last + 1]
+        dx, dy = bx - ax, by - ay
+        length2 = dx * dx + dy * dy
+        worst, worst_dist = None, limit
+        for i in range(first + 1, last):
+            px, py = coords[2 * i], coords[2 * i + 1]
+            if length2 == 0:
+                dist = (px - ax) ** 2 + (py - ay) ** 2
+            else:
+                cross = dx * (py - ay) - dy * (px - ax)
+                dist = cross * cross / length2
+            if dist > worst_dist:
+                worst, worst_dist = i, dist
+        if worst is not None:
+            keep[worst] = True
+            stack.append((first, worst))
+            stack.append((worst, last))
+    result = []
+    for i in range(n):
+        if keep[i]:
+            result += [coords[2 * i], coords[2 * i + 1]]
+    return result
+
+
+def simplify_stroke(coords, tolerance):
+    """Jitter filtering followed by RDP; tolerance is in document units."""
+    return rdp(drop_jitter(coords, tolerance), tolerance)
@@ -0,0 +1,186 @@
+"""Quadtree over axis-aligned bounding boxes.
+
+Used for hit-testing and region queries so that picking a shape does not
+need to look at (or ask Tk about) every shape in the drawing.  The tree grows
+outwards automatically when something is inserted outside its current root.
+Every node also caches the extent of its subtree, so the overall bounds of
+the drawing are available without scanning all entries.
+"""
+
+
+def intersects(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def contains(outer, inner):
+    return outer[0] <= inner[0] and outer[1] <= inner[1] and inner[2] <= outer[2] and inner[3] <= outer[3]
+
+
+def union(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+
+def on_edge(inner, outer):
+    return inner[0] <= outer[0] or inner[1] <= outer[1] or inner[2] >= outer[2] or inner[3] >= outer[3]
+
+
+class _Node:
+    __slots__ = ("bounds", "parent", "items", "children", "extent", "dirty")
+
+    def __init__(self, bounds, parent=None):
+        self.bounds = bounds
+        self.parent = parent
+        self.items = {}  # key -> bounds
+        self.children = None
+        self.extent = None  # union of every box in the subtree, unless dirty
+        self.dirty = False
+
+    def grow_extent(self, bounds):
+        node = self
+        while node is not None:
+            if not node.dirty:
+                node.extent = union(node.extent, bounds)
+            node = node.parent
+
+    def shrink_extent(self, bounds):
+        # A removed box can only shrink extents it touched; those are marked
+        # dirty and recomputed the next time somebody asks
+        node = self
+        while node is not None and (node.dirty or (node.extent is not None and on_edge(bounds, node.extent))):
+            node.dirty = True
+            node = node.parent
+
+    def compute_extent(self):
+        if self.dirty:
+            extent = None
+            for bounds in self.items.values():
+                extent = union(extent, bounds)
+            for child in self.children or ():
+                extent = union(extent, child.compute_extent())
+            self.extent = extent
+            self.dirty = False
+        return self.extent
+
+    def quadrants(self):
+        x1, y1, x2, y2 = self.bounds
+        mx, my = (x1 + x2) / 2.0, (y1 + y2) / 2.0
+        return [(x1, y1, mx, my), (mx, y1, x2, my), (x1, my, mx, y2), (mx, my, x2, y2)]
+
+
+class QuadTree:
+    """Maps hashable keys to bounding boxes (x1, y1, x2, y2).
+
+    Each key lives in the smallest node that fully contains its box, so
+    insert, update, remove and queries touch O(log n) nodes plus the k hits.
+    """
+
+    def __init__(self, bounds=(0, 0, 1024, 1024), capacity=16, min_size=4.0):
+        self.root = _Node(tuple(float(v) for v in bounds))
+        self.capacity = capacity
+        self.min_size = min_size
+        self._where = {}  # key -> node holding it
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, key):
+        return key in self._where
+
+    def bounds_of(self, key):
+        return self._where[key].items[key]
+
+    def insert(self, key, bounds):
+        if key in self._where:
+            self.remove(key)
+        while not contains(self.root.bounds, bounds):
+            self._grow(bounds)
+        node = self.root
+        while node.children:
+            child = next((c for c in node.children if contains(c.bounds, bounds)), None)
+            if child is None:
+                break
+            node = child
+        node.items[key] = bounds
+        node.grow_extent(bounds)
+        self._where[key] = node
+        if node.children is None and len(node.items) > self.capacity:
+            self._split(node)
+
+    def update(self, key, bounds):
+        node = self._where.get(key)
+        if node is None:
+            self.insert(key, bounds)
+            return
+        fits_here = contains(node.bounds, bounds)
+        fits_child = node.children and any(contains(c.bounds, bounds) for c in node.children)
+        if fits_here and not fits_child:
+            node.shrink_extent(node.items[key])
+            node.items[key] = bounds
+            node.grow_extent(bounds)
+        else:
+            self.remove(key)
+            self.insert(key, bounds)
+
+    def remove(self, key):
+        node = self._where.pop(key, None)
+        if node is None:
+            return False
+        node.shrink_extent(node.items.pop(key))
+        return True
+
+    def clear(self):
+        self.root = _Node(self.root.bounds)
+        self._where.clear()
+
+    def extent(self):
+        """Union of all boxes in the tree, or None when it is empty."""
+        return self.root.compute_extent()
+
+    def query(self, rect):
+        """Return the keys whose boxes intersect rect."""
+        found = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if not intersects(node.bounds, rect):
+                continue
+            for key, bounds in node.items.items():
+                if intersects(bounds, rect):
+                    found.append(key)
+            if node.children:
+                stack.extend(node.children)
+        return found
+
+    def query_point(self, x, y, tolerance=0):
+        return self.query((x - tolerance, y - tolerance, x + tolerance, y + tolerance))
+
+    def _split(self, node):
+        if node.bounds[2] - node.bounds[0] <= self.min_size:
+            return
+        node.children = [_Node(q, node) for q in node.quadrants()]
+        items, node.items = node.items, {}
+        for key, bounds in items.items():
+            target = next((c for c in node.children if contains(c.bounds, bounds)), node)
+            target.items[key] = bounds
+            self._where[key] = target
+        for child in node.children:
+            child.dirty = True
+
+    def _grow(self, bounds):
+        # Double the root towards the box that does not fit
+        old = self.root
+        x1, y1, x2, y2 = old.bounds
+        w, h = x2 - x1, y2 - y1
+        left = bounds[0] < x1
+        up = bounds[1] < y1
+        nx1 = x1 - w if left else x1
+        ny1 = y1 - h if up else y1
+        self.root = _Node((nx1, ny1, nx1 + 2 * w, ny1 + 2 * h))
+        self.root.extent, self.root.dirty = old.extent, old.dirty
+        self.root.children = [_Node(q, self.root) for q in self.root.quadrants()]
+        old.parent = self.root
+        self.root.children[(2 if up else 0) + (1 if left else 0)] = old
@@ -0,0 +1,60 @@
+from document import Document, Shape
+from eraser import erase_rect
+from history import History
+
+
+def state(document):
+    return [(s.id, s.z, s.kind, list(s.coords), dict(s.style)) for s in document]
+
+
+def test_cut_then_delete_in_one_step():
+    document = Document()
+    history = History(document)
+    document.add(Shape("line", (0, 0, 30, 0), width=1))
+    before = state(document)
+
+    history.begin()
+    erase_rect(document, (23, -5, 33, 5))
+    assert len(document) == 1  # cut, not deleted
+    erase_rect(document, (-5, -15, 25, 15))
+    assert len(document) == 0
+    history.end()
+
+    assert history.undo()
+    assert state(document) == before
+    assert history.redo()
+    assert len(document) == 0
+    assert history.undo()
+    assert state(document) == before
+
+
+def test_coords_then_move_in_one_step():
+    document = Document()
+    history = History(document)
+    shape_id = document.add(Shape("line", (0, 0, 10, 10)))
+    before = state(document)
+
+    history.begin()
+    document.set_coords(shape_id, (0, 0, 20, 20))
+    document.move(shape_id, 5, 5)
+    history.end()
+    after = state(document)
+    assert after[0][3] == [5, 5, 25, 25]
+
+    assert history.undo()
+    assert state(document) == before
+    assert history.redo()
+    assert state(document) == after
+
+
+def test_undo_style_key_the_shape_did_not_have():
+    document = Document()
+    history = History(document)
+    shape_id = document.add(Shape("line", (0, 0, 10, 10)))
+
+    document.modify(shape_id, color="red", width=4)
+    assert history.undo()
+    assert document.get(shape_id).style == {}
+    document.get(shape_id).bounds()
+    assert history.redo()
+    assert document.get(shape_id).style == {"color": "red", "width": 4}
@@ -0,0 +1,23 @@
+"""World <-> canvas coordinate mapping."""
+
+
+class ViewTransform:
+    """Uniform zoom from document (world) units to canvas units.
+
+    Shapes are always stored in world coordinates and projected through the
+    current scale, so zooming never compounds rounding errors.  Panning is
+    left to Tk's own scrolling (canvasx/canvasy), which costs nothing per item.
+    """
+
+    def __init__(self, scale=1.0):
+        self.scale = scale
+
+    def to_canvas(self, coords):
+        s = self.scale
+        return [c * s for c in coords]
+
+    def to_world(self, x, y):
+        return x / self.scale, y / self.scale
+
+    def length(self, value):
+        return value * self.scale
@@ -22,6 +22,8 @@ class GraphicsEditor:
         self.selected_item = None
         self.offset_x = 0
         self.offset_y = 0
+        self.pending_drag = None  # latest motion event not yet applied
+        self.drag_job = None
         self.image = None  # Placeholder for imported image
 
         self.init_ui()
@@ -161,6 +163,16 @@ class GraphicsEditor:
             self.add_text(event.x, event.y)
 
     def on_drag(self, event):
+        # Only the latest position matters; apply it once per frame
+        self.pending_drag = event
+        if self.drag_job is None:
+            self.drag_job = self.root.after(16, self.apply_drag)
+
+    def apply_drag(self):
+        self.drag_job = None
+        event, self.pending_drag = self.pending_drag, None
+        if event is None:
+            return
         if self.current_tool == "zoom":
             dx = event.x - self.start_x
             dy = event.y - self.start_y
@@ -174,6 +186,9 @@ class GraphicsEditor:
             self.start_x, self.start_y = event.x, event.y
 
     def on_release(self, event):
+        if self.drag_job is not None:
+            self.root.after_cancel(self.drag_job)
+            self.apply_drag()
         if self.current_tool in ["pencil", "eraser"]:
             self.pencil_coords = []
         else:
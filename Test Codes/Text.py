@@ -1,7 +1,10 @@
 import tkinter as tk
-from tkinter import simpledialog, filedialog, colorchooser
+from tkinter import simpledialog, filedialog, colorchooser, messagebox, ttk
 from PIL import Image, ImageTk
+import io
 import os
+import queue
+import threading
 
 # Main application class
 class GraphicsEditor:
@@ -71,11 +74,64 @@ class GraphicsEditor:
         file_path = filedialog.asksaveasfilename(defaultextension=".png", filetypes=[("PNG Files", "*.png")])
         if file_path:
             self.canvas.update()
-            ps_file = file_path + ".ps"
-            self.canvas.postscript(file=ps_file, colormode = 'color')
-            img = Image.open(ps_file)
+            # Only grabbing the PostScript needs Tk; the slow Ghostscript
+            # conversion runs on a thread so the editor stays usable.  Tk
+            # writes PostScript files in its system encoding, so do the same
+            ps = self.canvas.postscript(colormode = 'color')
+            try:
+                data = ps.encode(self.root.tk.call("encoding", "system"), "replace")
+            except LookupError:
+                data = ps.encode("utf-8")  # a Tcl encoding name Python does not know
+            results = queue.Queue()
+            cancel = threading.Event()
+            dialog = self.save_progress(file_path, cancel)
+            threading.Thread(target=self.convert_postscript, args=(data, file_path, results, cancel), daemon=True).start()
+            self.root.after(100, self.check_save, results, cancel, dialog)
+
+    def save_progress(self, file_path, cancel):
+        # Ghostscript gives no progress, so the bar only shows that it is busy
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Saving")
+        dialog.resizable(False, False)
+        tk.Label(dialog, text="Saving %s..." % os.path.basename(file_path)).pack(padx=10, pady=(10, 4))
+        bar = ttk.Progressbar(dialog, length=250, mode="indeterminate")
+        bar.pack(padx=10, pady=4)
+        bar.start(10)
+
+        def on_cancel():
+            cancel.set()
+            dialog.destroy()
+
+        tk.Button(dialog, text="Cancel", command=on_cancel).pack(pady=(4, 10))
+        dialog.protocol("WM_DELETE_WINDOW", on_cancel)
+        return dialog
+
+    def convert_postscript(self, data, file_path, results, cancel):
+        try:
+            img = Image.open(io.BytesIO(data))
+            img.load()
+            if cancel.is_set():
+                return
             img.save(file_path)
-            os.remove(ps_file)
+            if cancel.is_set():
+                # Cancelled while writing: leave nothing behind
+                os.remove(file_path)
+                return
+            results.put(None)
+        except Exception as exc:
+            results.put(exc)
+
+    def check_save(self, results, cancel, dialog):
+        if cancel.is_set():
+            return  # the dialog is gone and the result is dropped
+        try:
+            error = results.get_nowait()
+        except queue.Empty:
+            self.root.after(100, self.check_save, results, cancel, dialog)
+            return
+        dialog.destroy()
+        if error is not None:
+            messagebox.showerror("Save", "Could not save: %s" % error)
 
     def load_canvas(self):
         file_path = filedialog.askopenfilename(filetypes=[("Image Files", "*.png", "*.jpeg", "*.jpg")])
@@ -95,8 +151,10 @@ class GraphicsEditor:
 
     def on_drag(self, event):
         if self.current_tool and self.start_x and self.start_y:
-            self.canvas.delete(self.current_item)
-            if self.current_tool == "line":
+            if self.current_item:
+                # Move the existing preview instead of recreating it
+                self.canvas.coords(self.current_item, self.start_x, self.start_y, event.x, event.y)
+            elif self.current_tool == "line":
                 self.current_item = self.canvas.create_line(self.start_x, self.start_y, event.x, event.y, fill="black")
             elif self.current_tool == "rectangle":
                 self.current_item = self.canvas.create_rectangle(self.start_x, self.start_y, event.x, event.y, outline="black")
@@ -3,17 +3,121 @@ from tkinter.colorchooser import askcolor
 from tkinter import filedialog
 from PIL import Image, ImageDraw
 
+def _contains(outer, inner):
+    return outer[0] <= inner[0] and outer[1] <= inner[1] and inner[2] <= outer[2] and inner[3] <= outer[3]
+
+def _intersects(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+class _Node:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.items = {}  # shape -> bounds
+        self.children = None
+
+    def quadrants(self):
+        x1, y1, x2, y2 = self.bounds
+        mx, my = (x1 + x2) / 2.0, (y1 + y2) / 2.0
+        return [(x1, y1, mx, my), (mx, y1, x2, my), (x1, my, mx, y2), (mx, my, x2, y2)]
+
+class QuadTree:
+    """Maps shapes to their bounding boxes for O(log n + k) picking.
+
+    Each shape lives in the smallest node that fully contains its box, so a
+    point query only visits the nodes around the point instead of asking Tk
+    for the bbox of every shape on the canvas.  The root doubles outwards
+    when a box does not fit.
+    """
+
+    def __init__(self, bounds=(0, 0, 1024, 1024), capacity=16, min_size=4.0):
+        self.root = _Node(tuple(float(v) for v in bounds))
+        self.capacity = capacity
+        self.min_size = min_size
+        self.where = {}  # shape -> node holding it
+
+    def insert(self, shape, bounds):
+        self.remove(shape)
+        while not _contains(self.root.bounds, bounds):
+            self._grow(bounds)
+        node = self.root
+        while node.children:
+            child = next((c for c in node.children if _contains(c.bounds, bounds)), None)
+            if child is None:
+                break
+            node = child
+        node.items[shape] = bounds
+        self.where[shape] = node
+        if node.children is None and len(node.items) > self.capacity:
+            self._split(node)
+
+    def update(self, shape, bounds):
+        self.insert(shape, bounds)
+
+    def remove(self, shape):
+        node = self.where.pop(shape, None)
+        if node is not None:
+            del node.items[shape]
+
+    def query_point(self, x, y, tolerance=0):
+        rect = (x - tolerance, y - tolerance, x + tolerance, y + tolerance)
+        found = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if not _intersects(node.bounds, rect):
+                continue
+            found.extend(shape for shape, bounds in node.items.items() if _intersects(bounds, rect))
+            if node.children:
+                stack.extend(node.children)
+        return found
+
+    def _split(self, node):
+        if node.bounds[2] - node.bounds[0] <= self.min_size:
+            return
+        node.children = [_Node(q) for q in node.quadrants()]
+        items, node.items = node.items, {}
+        for shape, bounds in items.items():
+            target = next((c for c in node.children if _contains(c.bounds, bounds)), node)
+            target.items[shape] = bounds
+            self.where[shape] = target
+
+    def _grow(self, bounds):
+        # Double the root towards the box that does not fit
+        old = self.root
+        x1, y1, x2, y2 = old.bounds
+        w, h = x2 - x1, y2 - y1
+        left, up = bounds[0] < x1, bounds[1] < y1
+        nx1 = x1 - w if left else x1
+        ny1 = y1 - h if up else y1
+        self.root = _Node((nx1, ny1, nx1 + 2 * w, ny1 + 2 * h))
+        self.root.children = [_Node(q) for q in self.root.quadrants()]
+        self.root.children[(2 if up else 0) + (1 if left else 0)] = old
+
 class Shape:
     def __init__(self, canvas, shape_id, shape_type):
         self.canvas = canvas
         self.shape_id = shape_id
         self.shape_type = shape_type
+        self.index = None
+        self.bounds = None
+
+    def track(self, index):
+        # Start indexing the shape; its bbox is asked from Tk only this once
+        self.index = index
+        self.bounds = tuple(self.canvas.bbox(self.shape_id))
+        index.insert(self, self.bounds)
 
     def move(self, dx, dy):
         self.canvas.move(self.shape_id, dx, dy)
+        if self.bounds:
+            x1, y1, x2, y2 = self.bounds
+            self.bounds = (x1 + dx, y1 + dy, x2 + dx, y2 + dy)
+            self.index.update(self, self.bounds)
 
     def delete(self):
         self.canvas.delete(self.shape_id)
+        if self.index is not None:
+            self.index.remove(self)
 
     def modify(self, color=None, line_width=None, fill=None):
         options = {}
@@ -24,6 +128,10 @@ class Shape:
         if fill:
             options["fill"] = fill
         self.canvas.itemconfig(self.shape_id, **options)
+        if line_width and self.bounds:
+            # Outline width changes the item's extent
+            self.bounds = tuple(self.canvas.bbox(self.shape_id))
+            self.index.update(self, self.bounds)
 
 class GraphicsEditor:
     def __init__(self, root):
@@ -40,6 +148,7 @@ class GraphicsEditor:
         self.fill = None
         self.line_width = 2
         self.shapes = []
+        self.shape_index = QuadTree()
         self.selected_shape = None
 
         # Track drawing coordinates
@@ -109,21 +218,18 @@ class GraphicsEditor:
 
     def on_release(self, event):
         if self.start_x and self.start_y and self.selected_shape:
+            self.selected_shape.track(self.shape_index)
             self.shapes.append(self.selected_shape)
             self.start_x, self.start_y = None, None
 
     def select_shape(self, x, y, shape_id):
         tolerance = 5
         selected_shape = None
-        for shape in self.shapes:
-            bbox = self.canvas.bbox(shape.shape_id)
-            
-            expanded_bbox = (bbox[0] - tolerance, bbox[1] - tolerance, bbox[2] + tolerance, bbox[3] + tolerance)
-            
-            # Check if the click is within the expanded bounding box
-            if x >= expanded_bbox[0] and y >= expanded_bbox[1] and x <= expanded_bbox[2] and y <= expanded_bbox[3]:
-                selected_shape = shape
-                break
+        # Shapes whose bounding box (expanded by the tolerance) contains the click
+        hits = self.shape_index.query_point(x, y, tolerance)
+        if hits:
+            # Earliest drawn shape wins, as with the old linear scan
+            selected_shape = min(hits, key=lambda shape: shape.shape_id)
 
         # Update selection
         if selected_shape:
@@ -1,8 +1,10 @@
 from tkinter import *
 from tkinter import colorchooser
-import PIL.ImageGrab as ImageGrab
 from tkinter import filedialog
 from tkinter import messagebox
+from tkinter import simpledialog
+from PIL import Image, ImageDraw, ImageFont
+import zlib
 
 root = Tk()
 root.title("Paint App")
@@ -32,6 +34,83 @@ currentPoint = [0,0]
 # variable for text
 textValue = StringVar()
 
+# everything drawn on the canvas, replayed by renderImage() when saving
+CANVAS_WIDTH = 1100
+CANVAS_HEIGHT = 500
+drawing = []
+
+# the drawing at scale 1, kept up to date as it is drawn; strokes are undone
+# by restoring the tiles of it they touched
+raster = Image.new("RGB", (CANVAS_WIDTH, CANVAS_HEIGHT), "white")
+rasterDraw = ImageDraw.Draw(raster)
+rasterFont = ImageFont.load_default(12)
+
+# ---------------------- undo ------------------------------
+
+class TileUndo:
+    """Undo store of raster strokes that keeps only the tiles each one changed.
+
+    touch(box) is called before drawing into box: the tiles under it are saved
+    (zlib-compressed) the first time the current stroke touches them.  undo()
+    pastes them back, so its cost depends on the stroke, not on the canvas.
+    The oldest strokes are forgotten once the saved tiles exceed budget bytes.
+    """
+
+    TILE = 64
+
+    def __init__(self, image, budget=8 << 20):
+        self.image = image
+        self.budget = budget
+        self.strokes = []
+        self.size = 0
+        self.tiles = None
+        self.payload = None
+
+    def begin(self, payload):
+        # payload is handed back by undo(), e.g. what to remove from the canvas
+        self.tiles = {}
+        self.payload = payload
+
+    def touch(self, box):
+        t = self.TILE
+        x0, y0 = max(0, int(box[0]) // t), max(0, int(box[1]) // t)
+        x1 = min(self.image.width - 1, int(box[2])) // t
+        y1 = min(self.image.height - 1, int(box[3])) // t
+        for ty in range(y0, y1 + 1):
+            for tx in range(x0, x1 + 1):
+                if (tx, ty) not in self.tiles:
+                    tile = self.image.crop((tx * t, ty * t, min((tx + 1) * t, self.image.width), min((ty + 1) * t, self.image.height)))
+                    self.tiles[tx, ty] = (tile.size, zlib.compress(tile.tobytes(), 1))
+
+    def end(self):
+        if self.tiles is None:
+            return
+        size = sum(len(data) for _, data in self.tiles.values())
+        self.strokes.append((self.tiles, self.payload, size))
+        self.size += size
+        self.tiles = None
+        while self.size > self.budget and len(self.strokes) > 1:
+            self.size -= self.strokes.pop(0)[2]
+
+    def undo(self):
+        """Restore the tiles of the latest stroke and return its payload (None if there is none)."""
+        self.end()
+        if not self.strokes:
+            return None
+        tiles, payload, size = self.strokes.pop()
+        self.size -= size
+        for (tx, ty), (tileSize, data) in tiles.items():
+            self.image.paste(Image.frombytes("RGB", tileSize, zlib.decompress(data)), (tx * self.TILE, ty * self.TILE))
+        return payload
+
+    def clear(self):
+        self.strokes = []
+        self.size = 0
+        self.tiles = None
+
+history = TileUndo(raster)
+strokeCount = 0
+
 # --------------------- functions -------------------------
 
 def usePencil():
@@ -54,6 +133,29 @@ def selectColor():
         previousColorButton["bg"] = previousColor.get()
         previousColor2Button["bg"] = previousColor2.get()
 
+def strokeTag():
+    # Canvas tag of the current stroke, starting one if needed
+    global strokeCount
+    if history.tiles is None:
+        strokeCount += 1
+        history.begin(("stroke%d" % strokeCount, len(drawing)))
+    return history.payload[0]
+
+def record(item):
+    # Add item to the drawing and to the raster, saving the tiles it covers first
+    if item[0] == "segment":
+        _, x0, y0, x1, y1, color, size = item
+        box = (min(x0, x1) - size, min(y0, y1) - size, max(x0, x1) + size, max(y0, y1) + size)
+    elif item[0] == "dot":
+        _, x, y, color, size = item
+        box = (x - size, y - size, x + 2 * size, y + 2 * size)
+    else:
+        box = rasterDraw.textbbox((item[1], item[2]), item[3], font=rasterFont, anchor="mm")
+        box = (box[0] - 1, box[1] - 1, box[2] + 1, box[3] + 1)
+    history.touch(box)
+    drawItem(rasterDraw, item, 1, rasterFont)
+    drawing.append(item)
+
 def paint(event):
     global prevPoint
     global currentPoint
@@ -63,25 +165,66 @@ def paint(event):
     # canvas.create_oval(x , y , x +5 , y + 5 , fill="black")
 
     if prevPoint != [0,0] : 
-        canvas.create_polygon(prevPoint[0] , prevPoint[1] , currentPoint[0] , currentPoint[1],fill=stroke_color.get() , outline=stroke_color.get() , width=stroke_size.get())        
+        canvas.create_polygon(prevPoint[0] , prevPoint[1] , currentPoint[0] , currentPoint[1],fill=stroke_color.get() , outline=stroke_color.get() , width=stroke_size.get() , tags=strokeTag())        
+        record(("segment", prevPoint[0], prevPoint[1], currentPoint[0], currentPoint[1], stroke_color.get(), stroke_size.get()))
 
     prevPoint = currentPoint
 
     if event.type == "5" :
         prevPoint = [0,0]
+        history.end()
 
 def paintRight(event):
     x = event.x
     y = event.y
-    canvas.create_arc(x,y,x+stroke_size.get() , y+stroke_size.get() , fill=stroke_color.get() , outline=stroke_color.get() , width=stroke_size.get())
-    
+    canvas.create_arc(x,y,x+stroke_size.get() , y+stroke_size.get() , fill=stroke_color.get() , outline=stroke_color.get() , width=stroke_size.get() , tags=strokeTag())
+    record(("dot", x, y, stroke_color.get(), stroke_size.get()))
+
+def endStroke(event):
+    history.end()
+
+def undo(event=None):
+    payload = history.undo()
+    if payload is None:
+        return
+    tag, start = payload
+    canvas.delete(tag)
+    del drawing[start:]
+
+def drawItem(draw, item, scale, font):
+    if item[0] == "segment":
+        _, x0, y0, x1, y1, color, size = item
+        draw.line((x0 * scale, y0 * scale, x1 * scale, y1 * scale), fill=color, width=max(1, round(size * scale)))
+    elif item[0] == "dot":
+        # Tk arcs default to a 90 degree pie slice, counterclockwise from 3 o'clock
+        _, x, y, color, size = item
+        draw.pieslice((x * scale, y * scale, (x + size) * scale, (y + size) * scale), -90, 0,
+                      fill=color, outline=color, width=max(1, round(size * scale)))
+    else:
+        _, x, y, text = item
+        draw.text((x * scale, y * scale), text, fill="black", font=font, anchor="mm")
+
+def renderImage(scale=1):
+    # Replay the recorded drawing offscreen, at any resolution and without
+    # depending on what is visible on screen
+    if scale == 1:
+        return raster.copy()
+    img = Image.new("RGB", (round(CANVAS_WIDTH * scale), round(CANVAS_HEIGHT * scale)), "white")
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.load_default(max(1, round(12 * scale)))
+    for item in drawing:
+        drawItem(draw, item, scale, font)
+    return img
 
 def saveImage():
     try:
         fileLocation = filedialog.asksaveasfilename(defaultextension="jpg")
-        x = root.winfo_rootx()
-        y = root.winfo_rooty()+100
-        img = ImageGrab.grab(bbox=(x,y,x+1100,y+500))
+        if not fileLocation:
+            return
+        scale = simpledialog.askfloat("Paint App" , "Scale (1 = canvas size %dx%d):" % (CANVAS_WIDTH, CANVAS_HEIGHT) , initialvalue=1 , minvalue=0.1 , maxvalue=20)
+        if scale is None:
+            return
+        img = renderImage(scale)
         img.save(fileLocation)
         showImage = messagebox.askyesno("Paint App" , "Do you want to open image?")
         if showImage:
@@ -94,6 +237,9 @@ def saveImage():
 def clear():
     if messagebox.askokcancel("Paint app" , "Do you want to clear everything?"):
         canvas.delete('all')
+        drawing.clear()
+        raster.paste((255, 255, 255), (0, 0, CANVAS_WIDTH, CANVAS_HEIGHT))
+        history.clear()
 
 def createNew():
     if messagebox.askyesno("Paint app" , "Do you want to save before you clear everything?"):
@@ -111,7 +257,10 @@ def about():
     messagebox.showinfo("About" , "This paint app is best!")
 
 def writeText(event):
-    canvas.create_text(event.x , event.y , text=textValue.get())
+    history.end()
+    canvas.create_text(event.x , event.y , text=textValue.get() , tags=strokeTag())
+    record(("text", event.x, event.y, textValue.get()))
+    history.end()
 # ------------------- User Interface -------------------
 
 # Frame - 1 : Tools 
@@ -128,6 +277,8 @@ pencilButton = Button(toolsFrame , text="Pencil" , width=10 , command=usePencil)
 pencilButton.grid(row=0 , column=0)
 eraserButton = Button(toolsFrame , text="Eraser" , width=10 , command=useEraser)
 eraserButton.grid(row=1 , column=0)
+undoButton = Button(toolsFrame , text="Undo" , width=10 , command=undo)
+undoButton.grid(row=2 , column=0)
 toolsLabel = Label(toolsFrame , text="Tools", width=10)
 toolsLabel.grid(row=3 , column=0)
 
@@ -222,12 +373,15 @@ textTitleButton.grid(row=0 , column=0)
 frame2 = Frame(root , height=500 , width=1100 , bg="yellow")
 frame2.grid(row=1 , column=0)
 
-canvas = Canvas(frame2 , height=500 , width=1100 , bg="white" )
+canvas = Canvas(frame2 , height=CANVAS_HEIGHT , width=CANVAS_WIDTH , bg="white" )
 canvas.grid(row=0 , column=0)
 canvas.bind("<B1-Motion>", paint)
 canvas.bind("<ButtonRelease-1>", paint)
 canvas.bind("<B3-Motion>" , paintRight)
+canvas.bind("<ButtonRelease-3>" , endStroke)
 canvas.bind("<Button-2>", writeText)
 
+root.bind("<Control-z>", undo)
+
 root.resizable(False , False)
 root.mainloop()
\ No newline at end of file